@@ -5,9 +5,13 @@ import os
 from pathlib import Path
 import sys
 
-from src.bq import bq_replace_lib_table, bq_append_diff_table
-from src.diff_creator import get_diff_pdf
-from src.scan_library import full_scan, cached_scan, check_df_na
+from src.aggregates import maintain_aggregates
+from src.bq import bq_ensure_tables, bq_replace_lib_table, bq_append_diff_table, bq_load_lib_history_partition, bq_migrate_diff_table
+from src.date_utils import write_report_atomic, fingerprints_path
+from src.diff_creator import get_diff_pdf, get_recent_report_path, get_old_fingerprints, report_fingerprints
+from src.journal import ScanJournal
+from src.quarantine import Quarantine
+from src.scan_library import full_scan, cached_scan, check_df_na, FILE_TIMEOUT_S, FILE_MEMLIMIT_MB
 
 LOG_DIR = Path(os.environ['LOGS_TARGET'])
 LIBRARY_DIR = Path(os.environ['LIBRARY_TARGET'])
@@ -15,19 +19,46 @@ REPORT_DIR = Path(os.environ['REPORT_TARGET'])
 
 def main():
 
+    # One-off migration of a diff table created before partitioning
+    if FLAGS.bq_migrate_diff_table:
+        bq_migrate_diff_table()
+        return
+
+    # Journal extracted records, so an interrupted scan can be resumed
+    journal = ScanJournal(directory=REPORT_DIR, resume=FLAGS.resume)
+
+    # Files which failed extraction; skipped until they change
+    quarantine = Quarantine(directory=REPORT_DIR)
+    quarantine.prune(os.listdir(LIBRARY_DIR))
+
     # Scan music library to df
     if FLAGS.fullscan:
         logger.info("Full Scan initiated. Not using cache.")
-        new = full_scan(path_to_lib=LIBRARY_DIR)
+        new = full_scan(
+            path_to_lib=LIBRARY_DIR,
+            path_to_report_dir=REPORT_DIR,
+            journal=journal,
+            quarantine=quarantine,
+            file_timeout=FLAGS.file_timeout,
+            file_memlimit=FLAGS.file_memlimit
+        )
     else:
         logger.info("Cached Scan initiated.")
         new = cached_scan(
             path_to_lib=LIBRARY_DIR,
-            path_to_report_dir=REPORT_DIR
+            path_to_report_dir=REPORT_DIR,
+            journal=journal,
+            quarantine=quarantine,
+            file_timeout=FLAGS.file_timeout,
+            file_memlimit=FLAGS.file_memlimit
         )
+    journal.close()
 
     # Get diff df; old is read from local (not bq)
-    diff = get_diff_pdf(new)
+    # Only its fingerprints, and the rows which changed, are read
+    old_report = get_recent_report_path(REPORT_DIR)
+    old_fps = get_old_fingerprints(old_report)
+    diff = get_diff_pdf(new, old_report=old_report, old_fps=old_fps)
 
     # Check for na values in df
     check_df_na(new)
@@ -36,25 +67,56 @@ def main():
 
     # Save new to Local: in newline delimited json format
     if not FLAGS.nolocal_and_nobqdiff:
-        df_out_path = f"{REPORT_DIR}/report {dt_now_str}.jsonl"
-        new.to_json(df_out_path, force_ascii=False, orient='records', lines=True)
+        df_out_path = REPORT_DIR/f"report {dt_now_str}.jsonl"
+        write_report_atomic(new, df_out_path)
+        # After the report; a report without fingerprints is read in full
+        write_report_atomic(report_fingerprints(new), fingerprints_path(df_out_path))
         logger.info(f"Saved df as json file to {df_out_path}")
 
-    # Write to bq, replacing the table
+        # Save diff to Local too; for the query service
+        if len(diff) > 0:
+            diff_out_path = REPORT_DIR/"diffs"/f"diff {dt_now_str}.jsonl"
+            diff_out_path.parent.mkdir(exist_ok=True)
+            write_report_atomic(diff, diff_out_path)
+            logger.info(f"Saved diff as json file to {diff_out_path}")
+
+        # Update dashboard aggregates from diff; saved next to the reports
+        maintain_aggregates(
+            directory=REPORT_DIR,
+            diff=diff,
+            old_report=old_report,
+            old_fps=old_fps,
+            new=new,
+            new_report=df_out_path.name
+        )
+
+    # Create partitioned tables if needed; add new fields from schema.yaml
+    if not (FLAGS.nobqlib and FLAGS.nolocal_and_nobqdiff):
+        bq_ensure_tables()
+
+    # Write to bq, replacing the table; and today's partition of history
     if not FLAGS.nobqlib:
         bq_replace_lib_table(df=new)
+        bq_load_lib_history_partition(df=new, date=datetime.now().date())
     if not FLAGS.nolocal_and_nobqdiff:
         bq_append_diff_table(df=diff)
 
+    # Scan results are committed; journal no longer needed
+    journal.discard()
+
 
 if __name__ == '__main__':
 
     # Parse arguments
     parser = argparse.ArgumentParser(description = 'Say hello')
     parser.add_argument('--fullscan', action="store_true", help='Option: Do not use cache when scanning')
+    parser.add_argument('--resume', action="store_true", help='Option: Resume an interrupted scan; skip files already journaled')
+    parser.add_argument('--file_timeout', type=int, default=FILE_TIMEOUT_S, help='Option: Max. seconds to extract tags of a single file')
+    parser.add_argument('--file_memlimit', type=int, default=FILE_MEMLIMIT_MB, help='Option: Max. memory (MB) to extract tags of a single file')
     parser.add_argument('--nobqlib', action="store_true", help='Option: Do not upload lib to BigQuery')
     parser.add_argument('--nolocal_and_nobqdiff', action="store_true", help='Option: Do not save to local disk. Do not upload diff to BigQuery')
     parser.add_argument('--nowritelog', action="store_true", help='Option: Do not write to log file')
+    parser.add_argument('--bq_migrate_diff_table', action="store_true", help='Option: Only partition the existing (unpartitioned) diff table in BigQuery, then exit')
     FLAGS = parser.parse_args()
     
     # Logging configuration using file
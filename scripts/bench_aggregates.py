@@ -0,0 +1,105 @@
+""" Benchmark: incremental aggregate update vs full recompute.
+
+Builds synthetic libraries of increasing size, applies a fixed-size diff
+batch to each, and times update_aggregates() against compute_aggregates().
+The update time should stay flat as the library grows.
+
+Rows whose untracked aggregated columns changed are found beforehand, by
+comparing the fingerprints saved in the reports; that comparison is timed
+separately ("detect"). Like the diff's own, it is a single hash compare.
+
+Usage (from repo root):
+    python -m scripts.bench_aggregates
+"""
+import random
+import timeit
+
+import pandas as pd
+
+from src.aggregates import compute_aggregates, update_aggregates, agg_fingerprints, changed_agg_ids
+from src.aggregates import _compare_aggregates
+
+GENRES = ['Pop', 'Rock', 'Jazz', 'Classical', 'Electronic', 'Hip-Hop']
+LANGUAGES = ['English', 'Japanese', 'Korean', 'Mandarin', 'Instrumental']
+GENDERS = ['Male', 'Female', 'Mixed', 'None']
+RATINGS = [x / 2 for x in range(0, 11)]
+
+N_CHANGES = 100
+SIZES = [1_000, 10_000, 100_000]
+
+
+def synthetic_library(
+    n: int,
+    start_id: int = 0
+) -> pd.DataFrame :
+
+    rng = random.Random(n + start_id)
+    df = pd.DataFrame({
+        'ID': range(start_id, start_id + n),
+        'Major_Genre': [rng.choice(GENRES) for _ in range(n)],
+        'Major_Language': [rng.choice(LANGUAGES) for _ in range(n)],
+        'Gender': [rng.choice(GENDERS) for _ in range(n)],
+        'Rating': [rng.choice(RATINGS) for _ in range(n)],
+        'KPlay': pd.array([rng.choice([None, 1, 2, 3]) for _ in range(n)], dtype="Int64"),
+        'Time': [rng.uniform(120, 420) for _ in range(n)],
+    })
+    return df.set_index(keys='ID', drop=False)
+
+
+def synthetic_diff(
+    old: pd.DataFrame,
+    n_changes: int
+) -> tuple :
+    """ Returns (diff, new) where new = old with n_changes ins/del/upd;
+    and as many rows again whose untracked columns (Gender) changed, which
+    are not in diff
+    """
+
+    third = n_changes // 3
+    ids = old.index[:3 * third]
+    deleted, updated, untracked = ids[:third], ids[third:2 * third], ids[2 * third:]
+
+    inserted = synthetic_library(third, start_id=old.index.max() + 1)
+    new = pd.concat([old.drop(index=deleted), inserted])
+    new.loc[updated, 'Rating'] = 5.0
+    new.loc[untracked, 'Gender'] = "Changed"
+
+    records = (
+        [{'op': 'del', 'id': i} for i in deleted]
+        + [{'op': 'ins', 'id': i} for i in inserted.index]
+        + [{'op': 'upd', 'id': i} for i in updated]
+    )
+    return pd.DataFrame.from_records(records), new
+
+
+def main():
+
+    print(f"{'rows':>8} | {'update (ms)':>12} | {'detect (ms)':>12} | {'recompute (ms)':>15}")
+    for n in SIZES:
+        old = synthetic_library(n)
+        diff, new = synthetic_diff(old, N_CHANGES)
+        base = compute_aggregates(old)
+
+        # As saved in the old and new reports
+        old_fp, new_fp = agg_fingerprints(old), agg_fingerprints(new)
+        changed = changed_agg_ids(old_fp, new_fp)
+
+        t_upd = min(timeit.repeat(
+            lambda: update_aggregates(
+                {k: (dict(v) if isinstance(v, dict) else v) for k, v in base.items()},
+                diff, old, new, changed),
+            number=1, repeat=5))
+        t_detect = min(timeit.repeat(
+            lambda: changed_agg_ids(old_fp, new_fp), number=1, repeat=5))
+        t_full = min(timeit.repeat(
+            lambda: compute_aggregates(new), number=1, repeat=5))
+
+        # Sanity check: both paths agree
+        inc = update_aggregates(base, diff, old, new, changed)
+        assert _compare_aggregates(inc, compute_aggregates(new)) == []
+
+        print(f"{n:>8} | {t_upd * 1e3:>12.2f} | {t_detect * 1e3:>12.2f} | {t_full * 1e3:>15.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+""" Offline check of the BigQuery table layout in src/bq.py.
+
+Runs bq_ensure_tables(), the loads of main.py and the diff table migration
+against a fake client, which records the DDL and load job configs instead
+of calling BigQuery.
+Prints them, and asserts the partitioning/clustering expected. Needs
+google-cloud-bigquery installed, but no credentials or network.
+
+Usage (from repo root):
+    python -m scripts.check_bq_layout
+"""
+import datetime
+import os
+
+for k, v in {
+    'PROJECT_ID': 'proj', 'DATASET_ID': 'music',
+    'LIB_TABLE_ID': 'lib', 'DIFF_TABLE_ID': 'diff'
+}.items():
+    os.environ.setdefault(k, v)
+
+from google.cloud import bigquery as bq
+import pandas as pd
+
+from src import bq as bq_module
+
+
+class FakeClient:
+    """ Records calls. Tables are 'created' by query() with their DDL;
+    get_table() returns an existing table with one field less than the
+    schema, to exercise schema evolution. It is partitioned once any query
+    partitioned it.
+    """
+
+    def __init__(self):
+        self.queries = []
+        self.loads = []
+        self.jobs = []
+        self.updated = []
+
+    def query(self, sql):
+        self.queries.append(sql)
+        return self
+
+    def result(self):
+        return []
+
+    def get_table(self, table_ref):
+        partitioned = any("PARTITION BY" in q for q in self.queries)
+        schema = (
+            bq_module.parse_schema(bq_module.DIFF_BQ_SCHEMA)
+            if table_ref == bq_module.DIFF_TABLE_REF_STR
+            else bq_module.load_music_schema()
+        )
+        table = bq.Table(table_ref, schema=schema[:-1])
+        if partitioned:
+            table.time_partitioning = bq.TimePartitioning(type_="DAY")
+        return table
+
+    def update_table(self, table, fields):
+        self.updated.append((table.reference, fields, [f.name for f in table.schema]))
+
+    def load_table_from_dataframe(self, dataframe, destination, job_config):
+        self.loads.append((destination, job_config, dataframe))
+        self.jobs.append(FakeLoadJob(len(dataframe)))
+        return self.jobs[-1]
+
+
+class FakeLoadJob:
+    """ A load job, done once result() is called """
+
+    def __init__(self, n_rows):
+        self.job_id = "fake"
+        self.errors = None
+        self.n_rows = n_rows
+        self.output_rows = None
+
+    def result(self):
+        self.output_rows = self.n_rows
+        return self
+
+
+def main():
+
+    client = FakeClient()
+    bq_module.bq_ensure_tables(client=client)
+
+    df = pd.DataFrame([{
+        'ID': 1, 'DateAdded': "2022-02-01", 'Report_Time': "2022-02-01 12:00:00"
+    }])
+    date = datetime.date(2022, 2, 1)
+    bq_module.bq_replace_lib_table(df, client=client)
+    bq_module.bq_load_lib_history_partition(df, date, client=client)
+
+    for sql in client.queries:
+        print(sql, end="\n\n")
+    for table, fields, names in client.updated:
+        print(f"update_table {table} {fields}: {names}")
+    for destination, config, _ in client.loads:
+        print(f"load {destination}: {config.to_api_repr()['load']}")
+
+    diff_ddl, hist_ddl = client.queries
+    assert "PARTITION BY DATE(datetime)" in diff_ddl
+    assert "CLUSTER BY id, field_name" in diff_ddl
+    assert "PARTITION BY _PARTITIONDATE" in hist_ddl
+    assert "CLUSTER BY ID" in hist_ddl
+    assert len(client.updated) == 2 # the field missing from each table
+    assert all(job.output_rows == len(df) for job in client.jobs) # awaited
+
+    destination, config, loaded = client.loads[1]
+    assert destination == f"{bq_module.LIB_HISTORY_TABLE_REF_STR}$20220201"
+    assert config.write_disposition == "WRITE_TRUNCATE"
+    assert config.schema_update_options == ["ALLOW_FIELD_ADDITION"]
+    assert config.clustering_fields == ['ID']
+    assert not str(df['DateAdded'].dtype).startswith("datetime64") # caller's df untouched
+    assert str(loaded['DateAdded'].dtype).startswith("datetime64")
+
+    # Migration of an unpartitioned diff table; a no-op once partitioned
+    client = FakeClient()
+    bq_module.bq_migrate_diff_table(client=client)
+    bq_module.bq_migrate_diff_table(client=client)
+    print()
+    for sql in client.queries:
+        print(sql, end="\n\n")
+
+    create, rename_old, rename_new = client.queries
+    ref = bq_module.DIFF_TABLE_REF_STR
+    assert create.startswith(f"CREATE TABLE `{ref}_partitioned`")
+    assert "PARTITION BY DATE(datetime)" in create
+    assert create.endswith(f"AS SELECT * FROM `{ref}`")
+    assert rename_old == f"ALTER TABLE `{ref}` RENAME TO `{bq_module.DIFF_TABLE_ID}_unpartitioned`"
+    assert rename_new == f"ALTER TABLE `{ref}_partitioned` RENAME TO `{bq_module.DIFF_TABLE_ID}`"
+    print("\nOK")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+""" Load test: latency of the query service endpoints.
+
+Sends a mix of lookup, search, diff and conditional (If-None-Match)
+requests from concurrent clients, and reports p50/p99 latency per
+endpoint.
+
+By default, a server is started in-process over a synthetic report
+directory. Pass --url to test a running service instead (e.g. serve.py);
+then --ids and --terms should match its library.
+
+Usage (from repo root):
+    python -m scripts.loadtest_query_service [--url http://host:8080]
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import pathlib
+import random
+import statistics
+import tempfile
+import threading
+import time
+from urllib.error import HTTPError
+from urllib.parse import quote
+from urllib.request import Request, urlopen
+
+from src.query_service import QueryService, make_server
+
+WORDS = ['love', 'night', 'blue', 'dream', 'fire', 'rain', 'star', 'heart',
+         'road', 'light', 'moon', 'city', 'song', 'time', 'river', 'gold']
+
+
+def synthetic_report_dir(
+    n: int
+) -> pathlib.Path :
+
+    rng = random.Random(0)
+    d = pathlib.Path(tempfile.mkdtemp())
+    with open(d/"report 2026-01-01 00-00-00.jsonl", "w", encoding="utf8") as f:
+        for i in range(n):
+            f.write(json.dumps({
+                'ID': i,
+                'Title': " ".join(rng.sample(WORDS, 3)),
+                'Artist': f"Artist {i % 500}",
+                'Album': f"{rng.choice(WORDS)} Album {i % 2000}",
+                'Filename': f"{i}.flac",
+            }) + "\n")
+
+    (d/"diffs").mkdir()
+    with open(d/"diffs"/"diff 2026-01-01 00-00-00.jsonl", "w", encoding="utf8") as f:
+        for i in range(100):
+            f.write(json.dumps({
+                'op': 'upd', 'id': i, 'field_name': 'Rating',
+                'datetime': "2026-01-01 00-00-00"}) + "\n")
+    return d
+
+
+def request(
+    url: str,
+    etag: str = None
+) -> tuple :
+    """ Returns (status, etag, seconds) """
+
+    req = Request(url)
+    if etag is not None:
+        req.add_header('If-None-Match', etag)
+    t = time.perf_counter()
+    try:
+        with urlopen(req) as resp:
+            resp.read()
+            status, etag = resp.status, resp.headers.get('ETag')
+    except HTTPError as e: # incl. 304, 404
+        status, etag = e.code, e.headers.get('ETag')
+    return status, etag, time.perf_counter() - t
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Load test the query service')
+    parser.add_argument('--url', default=None, help='Base url of a running service')
+    parser.add_argument('--songs', type=int, default=60_000, help='Size of synthetic library')
+    parser.add_argument('--ids', type=int, default=None, help='Lookup IDs in [0, ids)')
+    parser.add_argument('--requests', type=int, default=5_000)
+    parser.add_argument('--clients', type=int, default=8)
+    FLAGS = parser.parse_args()
+
+    server = None
+    base = FLAGS.url
+    if base is None:
+        service = QueryService(synthetic_report_dir(FLAGS.songs))
+        server = make_server(service, host="127.0.0.1", port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+    n_ids = FLAGS.ids or FLAGS.songs
+
+    rng = random.Random(1)
+    _, etag, _ = request(f"{base}/songs/0")
+    kinds = {
+        'lookup_id': lambda: (f"{base}/songs/{rng.randrange(n_ids)}", None),
+        'lookup_filename': lambda: (
+            f"{base}/songs?filename={rng.randrange(n_ids)}.flac", None),
+        'search': lambda: (
+            f"{base}/search?q={quote(' '.join(rng.sample(WORDS, 2)))}", None),
+        'diff': lambda: (f"{base}/diff?since={quote('2025-12-31 00-00-00')}", None),
+        'conditional': lambda: (f"{base}/songs/0", etag),
+    }
+    jobs = [rng.choice(list(kinds)) for _ in range(FLAGS.requests)]
+    jobs = [(k, *kinds[k]()) for k in jobs]
+
+    latencies = {k: [] for k in kinds}
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=FLAGS.clients) as ex:
+        for k, (status, _, secs) in zip(
+            [j[0] for j in jobs],
+            ex.map(lambda j: request(j[1], j[2]), jobs)
+        ):
+            latencies[k].append(secs)
+    elapsed = time.perf_counter() - t0
+
+    print(f"{FLAGS.requests} requests, {FLAGS.clients} clients, "
+          f"{FLAGS.requests / elapsed:.0f} req/s")
+    print(f"{'endpoint':>16} | {'n':>5} | {'p50 (ms)':>9} | {'p99 (ms)':>9}")
+    for k, ls in latencies.items():
+        if len(ls) < 2:
+            continue
+        q = statistics.quantiles(ls, n=100)
+        print(f"{k:>16} | {len(ls):>5} | {q[49] * 1e3:>9.2f} | {q[98] * 1e3:>9.2f}")
+
+    if server is not None:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+import argparse
+import logging.config
+import os
+from pathlib import Path
+
+from src.query_service import QueryService, make_server
+
+LOG_DIR = Path(os.environ['LOGS_TARGET'])
+REPORT_DIR = Path(os.environ['REPORT_TARGET'])
+
+
+if __name__ == '__main__':
+
+    # Parse arguments
+    parser = argparse.ArgumentParser(description = 'Read-only HTTP query service over the latest report')
+    parser.add_argument('--host', default="0.0.0.0", help='Option: Address to bind to')
+    parser.add_argument('--port', type=int, default=8080, help='Option: Port to listen on')
+    parser.add_argument('--poll', type=int, default=60, help='Option: Seconds between checks for a new report')
+    parser.add_argument('--nowritelog', action="store_true", help='Option: Do not write to log file')
+    FLAGS = parser.parse_args()
+
+    # Logging configuration using file
+    logging.config.fileConfig(
+        fname="logging.config",
+        defaults={'logfilename': LOG_DIR/'music_service.log'}
+    )
+    logger = logging.getLogger('main')
+    if FLAGS.nowritelog:
+        logger.handlers = [ h for h in logger.handlers if not isinstance(h, logging.FileHandler) ]
+        logger.warning("Write to logs disabled. ")
+
+    service = QueryService(directory=REPORT_DIR)
+    service.watch(interval_s=FLAGS.poll)
+
+    server = make_server(service, host=FLAGS.host, port=FLAGS.port)
+    logger.info(f"STARTED: serving {REPORT_DIR} on {FLAGS.host}:{FLAGS.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logger.info("STOPPED: ")
@@ -0,0 +1,316 @@
+import json
+import logging
+import math
+import numbers
+import os
+import pathlib
+
+import pandas as pd
+
+from .date_utils import read_report_rows
+
+logger = logging.getLogger("main.aggregates")
+
+AGGREGATES_FILENAME = "aggregates.json"
+
+# Every n-th run, aggregates are recomputed from the full table and compared
+# against the incrementally maintained values.
+FULL_RECOMPUTE_EVERY = 7
+
+# Columns whose value counts are maintained
+COUNT_COLS = ['Major_Genre', 'Major_Language', 'Gender']
+
+# Columns which aggregates are computed from
+AGGREGATED_COLS = ['Time', 'KPlay', 'Rating'] + COUNT_COLS
+
+# Column of fingerprints files holding the fingerprint of AGGREGATED_COLS
+AGG_FINGERPRINT_COL = "Agg_Fingerprint"
+
+
+def compute_aggregates(
+    df: pd.DataFrame
+) -> dict :
+    """ Compute library aggregates from the full music DataFrame.
+
+    This is the O(library) reference implementation. Used to seed the
+    aggregates on first run, and to periodically verify the incrementally
+    maintained values of update_aggregates().
+
+    Returns:
+        A dictionary with the following keys:
+        - Tracks: int
+        - Time: float (total seconds)
+        - KPlay: int (total, null values are skipped)
+        - Major_Genre, Major_Language, Gender: dict of value -> count
+        - Rating: dict of rating (as str) -> count
+        - Report: Filename of the report described; set by
+          maintain_aggregates()
+    """
+
+    aggs = _empty_aggregates()
+    aggs['Tracks'] = len(df)
+    aggs['Time'] = float(df['Time'].sum())
+    aggs['KPlay'] = int(df['KPlay'].sum())
+
+    for col in COUNT_COLS + ['Rating']:
+        for value, n in df[col].value_counts(dropna=False).items():
+            aggs[col][_key(value)] = int(n)
+    return aggs
+
+
+def update_aggregates(
+    aggs: dict,
+    diff: pd.DataFrame,
+    old: pd.DataFrame,
+    new: pd.DataFrame,
+    changed: pd.Index = None
+) -> dict :
+    """ Update aggregates from a diff batch, in O(changes).
+
+    The diff only covers tracked fields (see schema.yaml). Rows whose other
+    aggregated columns (e.g. `Time`, `Gender`) changed are passed in
+    changed; see changed_agg_ids().
+
+    Args:
+        aggs: Aggregates of the old snapshot. Modified in place.
+        diff: Output of get_diff_pdf().
+        old: Rows of the old snapshot, indexed by ID. Must contain at least
+            the ids deleted or updated in diff, and the ids in changed.
+        new: Rows of the new snapshot, indexed by ID. Must contain at least
+            the ids inserted or updated in diff, and the ids in changed.
+        changed: IDs of rows whose aggregated columns changed.
+
+    Returns:
+        The updated aggregates
+    """
+
+    removed = added = changed if changed is not None else pd.Index([])
+    if len(diff) > 0:
+        removed = removed.union(diff.loc[diff['op'].isin(['del', 'upd']), 'id'].unique())
+        added = added.union(diff.loc[diff['op'].isin(['ins', 'upd']), 'id'].unique())
+
+    # Fetch all rows in one lookup each; row-wise .loc is slow
+    for row in old.loc[removed, AGGREGATED_COLS].to_dict('records'):
+        _apply_row(aggs, row, sign=-1)
+    for row in new.loc[added, AGGREGATED_COLS].to_dict('records'):
+        _apply_row(aggs, row, sign=1)
+
+    return aggs
+
+
+def maintain_aggregates(
+    directory: pathlib.Path,
+    diff: pd.DataFrame,
+    old_report: pathlib.Path,
+    old_fps: pd.DataFrame,
+    new: pd.DataFrame,
+    new_report: str
+) -> dict :
+    """ Load, update and persist the aggregates stored in directory.
+
+    The aggregates record the report they describe. They are only updated
+    incrementally if that is old_report; e.g. after a run which saved its
+    report but not its aggregates, they are recomputed instead.
+
+    The old snapshot is not loaded in full: rows whose aggregated columns
+    changed are found from the fingerprints, and only the old rows of those
+    and of the deleted/updated IDs are read from old_report.
+
+    Falls back to a full recompute when no aggregates are persisted yet, or
+    when FULL_RECOMPUTE_EVERY runs have passed since the last one. In the
+    latter case, any disagreement with the incremental values is logged.
+
+    Args:
+        directory: Directory where the snapshots (reports) are saved.
+        diff: Output of get_diff_pdf().
+        old_report: Report of the old snapshot.
+        old_fps: Fingerprints of old_report; see
+            diff_creator.get_old_fingerprints().
+        new: New snapshot.
+        new_report: Filename of the report of the new snapshot.
+
+    Returns:
+        The aggregates of the new snapshot
+    """
+
+    aggs = load_aggregates(directory)
+
+    if aggs is None:
+        logger.info("No aggregates found. Computing from full table.")
+        aggs = compute_aggregates(new)
+
+    elif aggs.get('Report') != old_report.name:
+        logger.warning(
+            f"Aggregates are of report {aggs.get('Report')}, not of {old_report.name}."
+            + " Computing from full table.")
+        aggs = compute_aggregates(new)
+
+    elif old_fps[AGG_FINGERPRINT_COL].isna().any():
+        logger.info("Old report has no aggregate fingerprints. Computing from full table.")
+        aggs = compute_aggregates(new)
+
+    else:
+        changed = changed_agg_ids(old_fps[AGG_FINGERPRINT_COL], agg_fingerprints(new))
+        logger.debug(f"{len(changed)} rows changed aggregate fingerprint")
+
+        ids = changed
+        if len(diff) > 0:
+            ids = ids.union(diff.loc[diff['op'].isin(['del', 'upd']), 'id'].unique())
+        old = read_report_rows(old_report, old_fps.loc[ids, 'Line'])
+        old = old.set_index(keys='ID', drop=False)
+
+        aggs = update_aggregates(
+            aggs, diff, old, new.set_index(keys='ID', drop=False), changed)
+        aggs['Runs_Since_Recompute'] += 1
+
+        if aggs['Runs_Since_Recompute'] >= FULL_RECOMPUTE_EVERY:
+            full = compute_aggregates(new)
+            for k in _compare_aggregates(aggs, full):
+                logger.warning(
+                    f"Aggregate `{k}` drifted: incremental={aggs[k]} full={full[k]}")
+            aggs = full
+
+    aggs['Report'] = new_report
+    save_aggregates(aggs, directory)
+    return aggs
+
+
+def agg_fingerprints(
+    df: pd.DataFrame
+) -> pd.Series :
+    """ Hash of the aggregated columns of each row, as 16-char hex string,
+    indexed by ID.
+
+    Saved in the fingerprints file of each report (see
+    diff_creator.report_fingerprints()); so that the next run finds
+    the rows whose aggregated columns changed by comparing hashes alone.
+    Values are normalised first, so that a row hashes the same whether it
+    was just extracted or read back from a report.
+    """
+
+    norm = pd.DataFrame({
+        'Time': df['Time'].astype(float).round(3), # json keeps ~10 digits
+        'KPlay': df['KPlay'].astype(float),
+        'Rating': df['Rating'].astype(float),
+        **{
+            col: df[col].astype(object).where(df[col].notna(), None)
+            for col in COUNT_COLS
+        }
+    })
+    h = pd.util.hash_pandas_object(norm, index=False)
+    return pd.Series(h.map('{:016x}'.format).values, index=df['ID'].values)
+
+
+def changed_agg_ids(
+    old_fp: pd.Series,
+    new_fp: pd.Series
+) -> pd.Index :
+    """ IDs in both old_fp and new_fp (see agg_fingerprints()) whose
+    fingerprints differ
+    """
+
+    common = old_fp.index.intersection(new_fp.index)
+    return common[old_fp.loc[common].values != new_fp.loc[common].values]
+
+
+def load_aggregates(
+    directory: pathlib.Path
+) -> dict :
+    """ Load persisted aggregates; None if there are none """
+
+    fpath = directory/AGGREGATES_FILENAME
+    if not fpath.exists():
+        return None
+    with open(fpath, "r", encoding="utf8") as f:
+        return json.load(f)
+
+
+def save_aggregates(
+    aggs: dict,
+    directory: pathlib.Path
+) -> None :
+    """ Persist aggregates next to the snapshots, replacing the old file """
+
+    fpath = directory/AGGREGATES_FILENAME
+    tmp = directory/f".{AGGREGATES_FILENAME}.tmp"
+    with open(tmp, "w", encoding="utf8") as f:
+        json.dump(aggs, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp, fpath)
+    logger.info(f"Saved aggregates to {fpath}")
+
+
+def _empty_aggregates() -> dict :
+
+    aggs = {
+        'Tracks': 0,
+        'Time': 0.0,
+        'KPlay': 0,
+        'Rating': {},
+        'Runs_Since_Recompute': 0,
+        'Report': None
+    }
+    for col in COUNT_COLS:
+        aggs[col] = {}
+    return aggs
+
+
+def _apply_row(
+    aggs: dict,
+    row: dict,
+    sign: int
+) -> None :
+    """ Add (sign=1) or remove (sign=-1) a row's contribution to aggs """
+
+    aggs['Tracks'] += sign
+    if not pd.isna(row['Time']):
+        aggs['Time'] += sign * float(row['Time'])
+    if not pd.isna(row['KPlay']):
+        aggs['KPlay'] += sign * int(row['KPlay'])
+
+    for col in COUNT_COLS + ['Rating']:
+        _bump(aggs[col], row[col], sign)
+
+
+def _bump(
+    counts: dict,
+    value,
+    sign: int
+) -> None :
+    """ Increment counts[value] by sign, dropping keys which reach 0 """
+
+    key = _key(value)
+    counts[key] = counts.get(key, 0) + sign
+    if counts[key] == 0:
+        del counts[key]
+
+
+def _key(
+    value
+) -> str :
+    """ json only permits str keys.
+    Numbers (i.e. ratings) are stored as floats, e.g. "4.0" or "4.5"; an
+    all-whole-number column read back from json is int64. Null values are
+    stored as "null".
+    """
+    if pd.isna(value):
+        return "null"
+    elif isinstance(value, numbers.Number) and not isinstance(value, bool):
+        return str(float(value))
+    else:
+        return str(value)
+
+
+def _compare_aggregates(
+    a: dict,
+    b: dict
+) -> list :
+    """ Returns keys whose values differ between aggregates a and b """
+
+    out = []
+    for k in ['Tracks', 'KPlay', 'Rating'] + COUNT_COLS:
+        if a[k] != b[k]:
+            out.append(k)
+    # Time is a float sum; it accumulates rounding error over many updates
+    if not math.isclose(a['Time'], b['Time'], rel_tol=1e-9, abs_tol=1e-3):
+        out.append('Time')
+    return out
@@ -1,3 +1,4 @@
+import datetime
 import logging
 import os
 import yaml
@@ -10,20 +11,48 @@ PROJECT_ID = os.environ['PROJECT_ID']
 DATASET_ID = os.environ['DATASET_ID']
 LIB_TABLE_ID = os.environ['LIB_TABLE_ID']
 DIFF_TABLE_ID = os.environ['DIFF_TABLE_ID']
+LIB_HISTORY_TABLE_ID = os.environ.get('LIB_HISTORY_TABLE_ID') or f"{LIB_TABLE_ID}_history" # may be set but empty
 
-# Authenticate with BigQuery
-bq_client = bq.Client() # TODO: use production credentials
+LIB_TABLE_REF_STR: str = f"{PROJECT_ID}.{DATASET_ID}.{LIB_TABLE_ID}"
+DIFF_TABLE_REF_STR: str = f"{PROJECT_ID}.{DATASET_ID}.{DIFF_TABLE_ID}"
+LIB_HISTORY_TABLE_REF_STR: str = f"{PROJECT_ID}.{DATASET_ID}.{LIB_HISTORY_TABLE_ID}"
+
+DIFF_BQ_SCHEMA = "op:STRING,id:INTEGER,field_name:STRING,field_type:STRING,old_val:STRING,new_val:STRING,datetime:DATETIME,remarks:STRING"
+
+# Legacy (schema api) type names -> Standard SQL type names, for DDL
+_DDL_TYPES = {'INTEGER': 'INT64', 'FLOAT': 'FLOAT64', 'BOOLEAN': 'BOOL'}
+
+# Authenticate with BigQuery; on first use, so that this module can be
+# imported (e.g. to generate DDL) without credentials
+bq_client = None
 
 logger = logging.getLogger("main.bq")
 
 
+def get_bq_client() -> bq.Client :
+    global bq_client
+    if bq_client is None:
+        bq_client = bq.Client() # TODO: use production credentials
+    return bq_client
 
-def bq_replace_lib_table(
-    df: pd.DataFrame
-) -> None :
 
-    # Construct uri string to BigQuery table
-    LIB_TABLE_REF_STR: str = f"{PROJECT_ID}.{DATASET_ID}.{LIB_TABLE_ID}"
+def parse_schema(
+    bq_schema: str
+) -> list :
+    """ Parse a "name:TYPE,name:TYPE,..." string into a list of SchemaField """
+
+    return [
+        bq.SchemaField(
+            name=f.split(':')[0],
+            field_type=f.split(':')[1],
+            mode='NULLABLE'
+        )
+        for f in bq_schema.split(',')
+    ]
+
+
+def load_music_schema() -> list :
+    """ BigQuery schema of the library tables, from schema.yaml """
 
     # Load schema from yaml file
     with open("./src/schema.yaml", "r") as stream:
@@ -32,63 +61,257 @@ def bq_replace_lib_table(
         _ = next(yaml_gen)
         bq_schema = next(yaml_gen)['bq_music_schema']
 
-    schema = [
-        bq.SchemaField(
-            name=f.split(':')[0], 
-            field_type=f.split(':')[1], 
-            mode='NULLABLE'
-        ) 
-        for f in bq_schema.split(',')
+    return parse_schema(bq_schema)
+
+
+def diff_table_ddl(
+    table_ref: str = DIFF_TABLE_REF_STR
+) -> str :
+    """ DDL of the diff table: partitioned by day of `datetime`, clustered by
+    `id` and `field_name`. Queries filtering on those scan only what they
+    need, rather than all history.
+    """
+    return _create_table_ddl(
+        table_ref,
+        parse_schema(DIFF_BQ_SCHEMA),
+        partition_by="DATE(datetime)",
+        cluster_by=['id', 'field_name']
+    )
+
+
+def lib_history_table_ddl(
+    table_ref: str = LIB_HISTORY_TABLE_REF_STR,
+    schema: list = None
+) -> str :
+    """ DDL of the library history table: one (ingestion-time) partition
+    per day, each holding that day's snapshot of the library. Clustered by
+    `ID`.
+
+    Point-in-time query: `WHERE _PARTITIONDATE = "2022-02-01"`
+    """
+    return _create_table_ddl(
+        table_ref,
+        schema if schema is not None else load_music_schema(),
+        partition_by="_PARTITIONDATE",
+        cluster_by=['ID']
+    )
+
+
+def partition_decorator(
+    table_ref: str,
+    date: datetime.date
+) -> str :
+    """ Reference to a single day partition of table_ref """
+    return f"{table_ref}${date.strftime('%Y%m%d')}"
+
+
+def lib_history_load_config(
+    schema: list = None
+) -> bq.LoadJobConfig :
+    """ Load config of a snapshot into a partition of the history table.
+
+    WRITE_TRUNCATE on a partition decorator replaces only that partition;
+    so re-running on the same day overwrites that day's snapshot and
+    nothing else. Tags added to schema.yaml are added to the table as new
+    columns.
+    """
+    return bq.LoadJobConfig(
+        schema=schema if schema is not None else load_music_schema(),
+        write_disposition="WRITE_TRUNCATE",
+        schema_update_options=[bq.SchemaUpdateOption.ALLOW_FIELD_ADDITION],
+        time_partitioning=bq.TimePartitioning(type_=bq.TimePartitioningType.DAY),
+        clustering_fields=['ID']
+    )
+
+
+def bq_ensure_tables(
+    client: bq.Client = None
+) -> None :
+    """ Create the diff and library history tables if they do not exist,
+    and add to them any field in their schema which they lack.
+
+    An existing table created before partitioning cannot be converted in
+    place; a warning is logged for it. See bq_migrate_diff_table().
+    """
+
+    client = client or get_bq_client()
+
+    for table_ref, ddl, schema in [
+        (DIFF_TABLE_REF_STR, diff_table_ddl(), parse_schema(DIFF_BQ_SCHEMA)),
+        (LIB_HISTORY_TABLE_REF_STR, lib_history_table_ddl(), load_music_schema()),
+    ]:
+        client.query(ddl).result()
+
+        table = client.get_table(table_ref)
+        if table.time_partitioning is None:
+            logger.warning(
+                f"{table_ref} is not partitioned. Run main.py once with"
+                + " --bq_migrate_diff_table to partition it")
+
+        existing = [f.name for f in table.schema]
+        missing = [f for f in schema if f.name not in existing]
+        if missing:
+            table.schema = list(table.schema) + missing
+            client.update_table(table, ["schema"])
+            logger.info(f"Added fields {[f.name for f in missing]} to {table_ref}")
+
+
+def diff_table_migration_sql(
+    table_ref: str = DIFF_TABLE_REF_STR
+) -> list :
+    """ Statements which recreate an existing, unpartitioned diff table as
+    partitioned (see diff_table_ddl()), keeping its rows.
+
+    The rows are copied into a new table, which then takes the name of the
+    old one. The old table is kept, renamed with suffix `_unpartitioned`;
+    drop it once the migration is verified.
+    """
+
+    table_id = table_ref.split('.')[-1]
+    tmp_ref = f"{table_ref}_partitioned"
+    return [
+        f"CREATE TABLE `{tmp_ref}`\n"
+        + "PARTITION BY DATE(datetime)\n"
+        + "CLUSTER BY id, field_name\n"
+        + f"AS SELECT * FROM `{table_ref}`",
+        f"ALTER TABLE `{table_ref}` RENAME TO `{table_id}_unpartitioned`",
+        f"ALTER TABLE `{tmp_ref}` RENAME TO `{table_id}`",
     ]
 
-    # Modify DateAdded and Report_Time type from "object" to "DateTime"
-    # schema in bq is DATE; requires this to be in pd's datetime format
-    df['DateAdded'] = pd.to_datetime(df['DateAdded'], format="%Y-%m-%d")
-    df['Report_Time'] = pd.to_datetime(df['Report_Time'], format="%Y-%m-%d %H:%M:%S")
 
-    bq_client.load_table_from_dataframe(
-        dataframe=df, 
+def bq_migrate_diff_table(
+    client: bq.Client = None
+) -> None :
+    """ One-off: partition a diff table created before partitioning.
+    Does nothing if the table is already partitioned.
+    """
+
+    client = client or get_bq_client()
+
+    table = client.get_table(DIFF_TABLE_REF_STR)
+    if table.time_partitioning is not None:
+        logger.info(f"{DIFF_TABLE_REF_STR} is already partitioned")
+        return
+
+    for sql in diff_table_migration_sql():
+        logger.info(f"Running: {sql}")
+        client.query(sql).result()
+
+    table = client.get_table(DIFF_TABLE_REF_STR)
+    logger.info(
+        f"Migrated {DIFF_TABLE_REF_STR} ({table.num_rows} rows); partitioned by"
+        + f" {table.time_partitioning}, clustered by {table.clustering_fields}")
+
+
+def bq_replace_lib_table(
+    df: pd.DataFrame,
+    client: bq.Client = None
+) -> None :
+
+    client = client or get_bq_client()
+
+    job = client.load_table_from_dataframe(
+        dataframe=_to_bq_types(df),
         destination=LIB_TABLE_REF_STR,
         job_config=bq.job.LoadJobConfig(
-            schema=schema,
+            schema=load_music_schema(),
             write_disposition="WRITE_TRUNCATE"
         )
     )
-    logger.info(f"load_table_from_dataframe to {LIB_TABLE_REF_STR} successful")
+    _await_load(job, LIB_TABLE_REF_STR)
+
+
+def bq_load_lib_history_partition(
+    df: pd.DataFrame,
+    date: datetime.date,
+    client: bq.Client = None
+) -> None :
+    """ Load df (a snapshot of the library) as the date partition of the
+    library history table, replacing only that partition.
+    """
+
+    client = client or get_bq_client()
+    destination = partition_decorator(LIB_HISTORY_TABLE_REF_STR, date)
+
+    job = client.load_table_from_dataframe(
+        dataframe=_to_bq_types(df),
+        destination=destination,
+        job_config=lib_history_load_config()
+    )
+    _await_load(job, destination)
+
 
 def bq_append_diff_table(
-    df: pd.DataFrame
+    df: pd.DataFrame,
+    client: bq.Client = None
 ) -> None :
 
     # Immediately return if there's no diff
     if len(df) == 0:
         return
 
-    # Construct uri string to BigQuery table
-    DIFF_TABLE_REF_STR: str = f"{PROJECT_ID}.{DATASET_ID}.{DIFF_TABLE_ID}"
-
-    bq_schema = "op:STRING,id:INTEGER,field_name:STRING,field_type:STRING,old_val:STRING,new_val:STRING,datetime:DATETIME,remarks:STRING"
-
-    schema = [
-        bq.SchemaField(
-            name=f.split(':')[0], 
-            field_type=f.split(':')[1], 
-            mode='NULLABLE'
-        ) 
-        for f in bq_schema.split(',')
-    ]
-
+    client = client or get_bq_client()
 
     # Modify datime's type from "object" to "DateTime"
     # schema in bq is DATE; requires this to be in pd's datetime format
     df['datetime'] = pd.to_datetime(df['datetime'], format="%Y-%m-%d %H-%M-%S")
 
-    bq_client.load_table_from_dataframe(
-        dataframe=df, 
+    job = client.load_table_from_dataframe(
+        dataframe=df,
         destination=DIFF_TABLE_REF_STR,
         job_config=bq.job.LoadJobConfig(
-            schema=schema,
+            schema=parse_schema(DIFF_BQ_SCHEMA),
             write_disposition="WRITE_APPEND"
         )
     )
-    logger.info(f"load_table_from_dataframe to {DIFF_TABLE_REF_STR} successful")
\ No newline at end of file
+    _await_load(job, DIFF_TABLE_REF_STR)
+
+
+def _await_load(
+    job: bq.LoadJob,
+    destination: str
+) -> None :
+    """ Wait for a load job to finish, and log its outcome.
+
+    Raises:
+        google.api_core.exceptions.GoogleAPICallError: If the job failed;
+            its errors are logged first.
+    """
+
+    try:
+        job.result()
+    except Exception:
+        logger.error(f"Load job {job.job_id} to {destination} failed: {job.errors}")
+        raise
+    logger.info(f"Load job {job.job_id} to {destination} done: {job.output_rows} rows loaded")
+
+
+def _to_bq_types(
+    df: pd.DataFrame
+) -> pd.DataFrame :
+    """ Copy of music df, with types compatible with its bq schema """
+
+    df = df.copy()
+    # Modify DateAdded and Report_Time type from "object" to "DateTime"
+    # schema in bq is DATE; requires this to be in pd's datetime format
+    df['DateAdded'] = pd.to_datetime(df['DateAdded'], format="%Y-%m-%d")
+    df['Report_Time'] = pd.to_datetime(df['Report_Time'], format="%Y-%m-%d %H:%M:%S")
+    return df
+
+
+def _create_table_ddl(
+    table_ref: str,
+    schema: list,
+    partition_by: str,
+    cluster_by: list
+) -> str :
+
+    cols = ",\n".join(
+        f"  `{f.name}` {_DDL_TYPES.get(f.field_type, f.field_type)}"
+        for f in schema
+    )
+    return (
+        f"CREATE TABLE IF NOT EXISTS `{table_ref}` (\n{cols}\n)\n"
+        + f"PARTITION BY {partition_by}\n"
+        + f"CLUSTER BY {', '.join(cluster_by)}"
+    )
@@ -1,5 +1,6 @@
 from datetime import datetime
 import glob
+import json
 import logging
 import os
 import pathlib
@@ -9,7 +10,7 @@ import pandas as pd
 
 logger = logging.getLogger("main.date_utils")
 
-def get_recent_df(directory=None) -> pd.DataFrame :
+def get_recent_df(directory=None, dtype=True) -> pd.DataFrame :
 
     if directory is None:
         pass
@@ -26,6 +27,7 @@ def get_recent_df(directory=None) -> pd.DataFrame :
         fpath, 
         orient='records', 
         convert_dates=False, 
+        dtype=dtype,
         lines=True) 
 
     return df
@@ -55,11 +57,85 @@ def find_file_with_latest_dt_in_dir(
 
     dt_latest = max(dt_ls).strftime("%Y-%m-%d %H-%M-%S")
 
+    # Match on ext too; so that e.g. temp files of a report being written
+    # are never picked up
     return pathlib.Path(
-        glob.glob(str(directory/f'*{dt_latest}*'))[0]
+        glob.glob(str(directory/f'*{dt_latest}{ext[1:]}'))[0]
     )
 
 
+def write_report_atomic(
+    df: pd.DataFrame,
+    filepath: pathlib.Path
+) -> None :
+    """ Save df as newline delimited json file, atomically.
+
+    df is first written to a temp file in the same directory, which is then
+    renamed to filepath. So readers (i.e. get_recent_df) see either no
+    report or the complete report; never a half-written one.
+    """
+
+    tmp = filepath.with_name(f".{filepath.name}.tmp")
+    df.to_json(tmp, force_ascii=False, orient='records', lines=True)
+    with open(tmp, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, filepath)
+
+
+def fingerprints_path(
+    report: pathlib.Path
+) -> pathlib.Path :
+    """ Path of the fingerprints file of a report: `report <dt>.fp.jsonl`.
+
+    It holds one line per row of the report, in the same order, with the
+    row's ID and fingerprints (see diff_creator.report_fingerprints()).
+    Its name still ends with the report's dt and `.jsonl`, so it is never
+    picked up as the report by find_file_with_latest_dt_in_dir().
+    """
+    return report.with_name(f"{report.stem}.fp.jsonl")
+
+
+def read_fingerprints(
+    report: pathlib.Path
+) -> pd.DataFrame :
+    """ The fingerprints file of report, indexed by ID; with column `Line`,
+    the line of each ID in the report. None if there is none (e.g. reports
+    saved before fingerprints files).
+    """
+
+    fpath = fingerprints_path(report)
+    if not fpath.exists():
+        return None
+
+    # Fingerprints are hex str; an all-digits one must not become a number
+    fps = pd.read_json(fpath, orient='records', lines=True, dtype=False)
+    fps['Line'] = range(len(fps))
+    return fps.set_index(keys='ID')
+
+
+def read_report_rows(
+    report: pathlib.Path,
+    lines
+) -> pd.DataFrame :
+    """ Rows of report at the given line numbers (e.g. from
+    read_fingerprints()). Only those lines are parsed; the rest are only
+    read past.
+    """
+
+    wanted = set(lines)
+    records = []
+    columns = None
+    with open(report, "r", encoding="utf8") as f:
+        for i, line in enumerate(f):
+            if i in wanted or columns is None:
+                record = json.loads(line)
+                columns = columns or list(record)
+                if i in wanted:
+                    records.append(record)
+
+    return pd.DataFrame.from_records(records, columns=columns)
+
+
 def num_mins_elapsed_since_last_modified(
     filepath: pathlib.Path,
 ) -> int : 
@@ -4,51 +4,86 @@ import os
 from pathlib import Path
 
 import pandas as pd
+import yaml
 
-from .date_utils import get_recent_df
+from .aggregates import AGG_FINGERPRINT_COL, agg_fingerprints
+from .date_utils import find_file_with_latest_dt_in_dir, read_fingerprints, read_report_rows
 
 REPORT_DIR = Path(os.environ['REPORT_TARGET'])
 
 logger = logging.getLogger("main.diff_creator")
 
+# Load tracked tags and their types from schema
+with open("./src/schema.yaml", "r") as stream:
+    yaml_gen = yaml.safe_load_all(stream) # load generator
+    _pd_schema_init = next(yaml_gen)
+    _pd_schema_completion = next(yaml_gen)
+    _bq_schema = next(yaml_gen)['bq_music_schema']
+    TRACKED_FIELDS = next(yaml_gen)['diff_tracked_fields'].split(',')
+
 pdf_schema = {
     "ID": "int64",
-    "Major_Genre": "object",
-    "Minor_Genre": "object",
-    "Rating": "float64",
-    "KPlay": "float64",
+    **{ f: _pd_schema_init[f] for f in TRACKED_FIELDS },
     "Filename": "object"
 }
 
 pdf_schema_nullable = {
-    "KPlay": "Int64"
+    f: _pd_schema_completion[f] for f in TRACKED_FIELDS
+    if f in _pd_schema_completion
+}
+
+tag_bq_type = {
+    f.split(':')[0]: f.split(':')[1] for f in _bq_schema.split(',')
+    if f.split(':')[0] in TRACKED_FIELDS
 }
 
+# Column of fingerprints files (and of older reports) holding the row
+# fingerprint
+FINGERPRINT_COL = "Fingerprint"
+
 
 def get_diff_pdf(
-    new: pd.DataFrame
+    new: pd.DataFrame,
+    old_report: Path = None,
+    old_fps: pd.DataFrame = None
 ) -> pd.DataFrame:
     """
 
-    """
+    The old snapshot is not loaded in full. Only its fingerprints are read
+    (see date_utils.fingerprints_path()), and then the rows of the deleted
+    and changed IDs.
 
-    tag_bq_type: dict = {
-        "Major_Genre": "STRING",
-        "Minor_Genre": "STRING",
-        "Rating": "FLOAT",
-        "KPlay": "INTEGER"
-    }
+    Args:
+        new: The new snapshot
+        old_report: Report of the old snapshot. If None, the most recent
+            report in REPORT_DIR
+        old_fps: Fingerprints of old_report, if already read; see
+            get_old_fingerprints()
+    """
 
-    old = get_old_df_for_diff()
+    if old_report is None:
+        old_report = get_recent_report_path()
+    if old_fps is None:
+        old_fps = get_old_fingerprints(old_report)
 
     new = refit_new_df_for_diff(new)
-    
+    new_fp = row_fingerprints(new)
+    old_fp = old_fps[FINGERPRINT_COL]
+
     dt_now_str : str = datetime.now().strftime("%Y-%m-%d %H-%M-%S") 
 
     OPERATIONS = []
-    
-    old_extraneous: list = [ x for x in old.index.tolist() if x not in new.index.tolist() ]
-    new_extraneous: list = [ x for x in new.index.tolist() if x not in old.index.tolist() ]
+
+    old_extraneous = old_fp.index.difference(new_fp.index)
+    new_extraneous = new_fp.index.difference(old_fp.index)
+    common = old_fp.index.intersection(new_fp.index)
+
+    # Only rows whose fingerprints differ are compared tag by tag
+    changed = common[old_fp.loc[common].values != new_fp.loc[common].values]
+    logger.debug(f"{len(changed)} of {len(common)} common rows changed fingerprint")
+
+    # Read (and cast) old values only of the rows needed
+    old = get_old_df_for_diff(old_report, old_fps, ids=old_extraneous.union(changed))
 
     # Add deletions to diff
     for i in old_extraneous:
@@ -69,12 +104,9 @@ def get_diff_pdf(
         })
     
     # Add updates to diff
-    oldd = old.drop(labels=old_extraneous, axis='index').copy()
-    neww = new.drop(labels=new_extraneous, axis='index').copy()
-
-    for i in oldd.index:
-        o = oldd.loc[i]
-        n = neww.loc[i]
+    for i in changed:
+        o = old.loc[i, TRACKED_FIELDS]
+        n = new.loc[i, TRACKED_FIELDS]
         d = o.compare(n, align_axis=1)
 
         for t in d.index:
@@ -121,18 +153,21 @@ def get_diff_pdf(
     return diff
 
 
-def get_old_df_for_diff():
+def get_old_df_for_diff(
+    old_report: Path,
+    old_fps: pd.DataFrame,
+    ids: pd.Index
+):
+    """ Rows of the old snapshot with the given IDs, refit for diff.
 
-    old = get_recent_df(REPORT_DIR)
-    old = old.set_index(
-        keys='ID',
-        drop=False,
-        append=False
-    )
+    Args:
+        old_report: Report of the old snapshot
+        old_fps: Its fingerprints; see get_old_fingerprints()
+        ids: IDs of the rows to read
+    """
 
-    # Keep only certain tags (that we are tracking for diff)
-    old = old[list(pdf_schema.keys())]
-    return old.astype(pdf_schema).astype(pdf_schema_nullable)
+    old = read_report_rows(old_report, old_fps.loc[ids, 'Line'])
+    return refit_new_df_for_diff(old)
 
 
 def refit_new_df_for_diff(
@@ -149,3 +184,83 @@ def refit_new_df_for_diff(
     # Keep only certain tags (that we are tracking for diff)
     new = new[list(pdf_schema.keys())]
     return new.astype(pdf_schema).astype(pdf_schema_nullable)
+
+
+def get_recent_report_path(
+    directory: Path = REPORT_DIR
+) -> Path :
+    """ Most recent report in directory """
+    return find_file_with_latest_dt_in_dir(
+        directory=directory,
+        re_search=r"\b20.*-\d\d",
+        ext="*.jsonl"
+    )
+
+
+def get_old_fingerprints(
+    old_report: Path
+) -> pd.DataFrame :
+    """ Fingerprints of the old snapshot, indexed by ID; with the line of
+    each ID in old_report (column `Line`).
+
+    Read from the fingerprints file of old_report. Reports saved before
+    fingerprints files are read in full instead, once: fingerprints are
+    taken from their columns if they have them, else computed.
+    """
+
+    fps = read_fingerprints(old_report)
+    if fps is not None:
+        return fps
+
+    logger.info(f"{old_report.name} has no fingerprints file; reading it in full")
+    old = pd.read_json(
+        old_report, orient='records', convert_dates=False, lines=True,
+        dtype={FINGERPRINT_COL: "object", AGG_FINGERPRINT_COL: "object"})
+
+    fps = pd.DataFrame(index=pd.Index(old['ID'].values, name='ID'))
+    if FINGERPRINT_COL in old.columns and old[FINGERPRINT_COL].notna().all():
+        fps[FINGERPRINT_COL] = old[FINGERPRINT_COL].values
+    else:
+        fps[FINGERPRINT_COL] = row_fingerprints(refit_new_df_for_diff(old)).values
+    # Without them, aggregates are recomputed (see maintain_aggregates())
+    fps[AGG_FINGERPRINT_COL] = (
+        old[AGG_FINGERPRINT_COL].values if AGG_FINGERPRINT_COL in old.columns else None)
+    fps['Line'] = range(len(old))
+    return fps
+
+
+def report_fingerprints(
+    df: pd.DataFrame
+) -> pd.DataFrame :
+    """ Fingerprints of df (a snapshot), to be saved as the fingerprints
+    file of its report (see date_utils.fingerprints_path()): ID, and the
+    fingerprints of the tracked tags and of the aggregated columns (see
+    aggregates.py). One row per row of df, in the same order.
+
+    So that the next diff (and aggregates update) reads only these, rather
+    than the old report.
+    """
+
+    return pd.DataFrame({
+        'ID': df['ID'].values,
+        FINGERPRINT_COL: row_fingerprints(refit_new_df_for_diff(df)).values,
+        AGG_FINGERPRINT_COL: agg_fingerprints(df).values
+    })
+
+
+def row_fingerprints(
+    df: pd.DataFrame
+) -> pd.Series :
+    """ Hash of the tracked tags of each row, as 16-char hex string.
+
+    Args:
+        df: Snapshot refitted for diff (see refit_new_df_for_diff)
+
+    Remarks:
+        - The hash depends on the set (and order) of TRACKED_FIELDS. If it
+          changes, every row of the next diff is compared tag by tag once;
+          the diff itself is unaffected.
+    """
+
+    h = pd.util.hash_pandas_object(df[TRACKED_FIELDS], index=False)
+    return h.map('{:016x}'.format)
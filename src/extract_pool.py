@@ -0,0 +1,199 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import logging
+import os
+import pathlib
+import re
+import signal
+
+try:
+    import resource # not available on Windows
+except ImportError:
+    resource = None
+
+from .tag_extractor import song_tag_extractor
+
+logger = logging.getLogger("main.extract_pool")
+
+
+class ExtractionTimeout(Exception):
+    pass
+
+
+WORKER_CRASHED = "Worker process crashed"
+
+
+def extract_isolated(
+    jobs: list,
+    timeout_s: int = 60,
+    mem_limit_mb: int = 1024,
+    max_workers: int = None
+):
+    """ Run song_tag_extractor on each file in a pool of worker processes.
+
+    Each file is extracted under a time limit (SIGALRM in the worker) and
+    the workers run under an address space limit (RLIMIT_AS). Exceptions
+    are caught in the worker and reported, instead of aborting the scan.
+
+    If a worker dies outright (e.g. killed by the OS), the pool is broken.
+    Only the files that may have been running then (the first
+    max_workers + 1 unfinished ones; the pool feeds workers in submission
+    order) are retried alone, each in a single-worker pool, so the
+    offending file is reported as failed. The other files are resubmitted
+    to a fresh pool of full size.
+
+    Args:
+        jobs: List of (fpath, fmt) tuples. fpath is a pathlib.Path to a
+            music file, fmt the name of its registered format
+        timeout_s: Max. seconds to spend on a single file
+        mem_limit_mb: Max. memory a worker may allocate, in MB
+        max_workers: No. of worker processes. Defaults to os.cpu_count()
+
+    Yields:
+        (fpath, record, error, transient) tuples, in order of completion.
+        Exactly one of record (dict) and error (str) is None. transient is
+        True if the error may not recur on retry: a timeout, an OS error
+        (e.g. the NAS dropping out) or a crashed worker.
+    """
+
+    n_workers = max_workers or os.cpu_count() or 1
+    pending = list(jobs)
+
+    while pending:
+        unfinished = yield from _run_pool(
+            pending, n_workers, timeout_s, mem_limit_mb)
+        if not unfinished:
+            break
+
+        # Pool broke; unfinished is in submission order
+        suspects = unfinished[:n_workers + 1]
+        pending = unfinished[n_workers + 1:]
+        logger.warning(
+            f"Worker process crashed. Retrying {len(suspects)} files one by one"
+            + f", and {len(pending)} files in a fresh pool")
+
+        for job in suspects:
+            crashed = yield from _run_pool([job], 1, timeout_s, mem_limit_mb)
+            if crashed:
+                yield job[0], None, WORKER_CRASHED, True
+
+
+def _run_pool(
+    jobs: list,
+    n_workers: int,
+    timeout_s: int,
+    mem_limit_mb: int
+):
+    """ Run jobs in one pool, yielding results as in extract_isolated().
+
+    Returns (to `yield from`):
+        List of the jobs without a result, in submission order; empty
+        unless the pool broke. Includes jobs which could not be submitted
+    """
+
+    futures = {}
+    broken = set()
+    with ProcessPoolExecutor(
+        max_workers=n_workers,
+        initializer=_init_worker,
+        initargs=(mem_limit_mb, )
+    ) as ex:
+        for p, fmt in jobs:
+            try:
+                futures[ex.submit(_extract_worker, p, fmt, timeout_s)] = (p, fmt)
+            except BrokenProcessPool: # a worker died during submission
+                break
+
+        for fut in as_completed(futures):
+            try:
+                record, error = fut.result()
+            except BrokenProcessPool:
+                broken.add(futures[fut][0])
+                continue
+            yield futures[fut][0], record, error, _is_transient(error)
+
+    submitted = {p for p, _ in futures.values()}
+    unfinished = [
+        (p, fmt) for p, fmt in jobs
+        if p in broken or p not in submitted
+    ]
+    return unfinished
+
+
+def _init_worker(
+    mem_limit_mb: int
+) -> None :
+    """ Initializer of worker processes: applies the memory limit """
+
+    if resource is None or mem_limit_mb is None:
+        return
+
+    # The limit is on top of what the (forked) worker already maps
+    limit = _address_space_bytes() + mem_limit_mb * 1024 * 1024
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def _extract_worker(
+    fpath: pathlib.Path,
+    fmt: str,
+    timeout_s: int
+) -> tuple :
+    """ Runs in worker process.
+
+    Returns:
+        (record, None) on success, (None, reason) on failure
+    """
+
+    def _on_alarm(signum, frame):
+        raise ExtractionTimeout(f"exceeded {timeout_s}s")
+
+    use_alarm = hasattr(signal, 'SIGALRM') and timeout_s is not None
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _on_alarm)
+        signal.alarm(timeout_s)
+    try:
+        return song_tag_extractor(fpath, fmt), None
+    except Exception as e: # incl. MemoryError, ExtractionTimeout
+        # mutagen wraps OS errors into its own; keep them recognisable
+        if isinstance(e.__context__, OSError) and not isinstance(e, OSError):
+            return None, f"{type(e).__name__} ({type(e.__context__).__name__}): {e}"
+        return None, f"{type(e).__name__}: {e}"
+    finally:
+        if use_alarm:
+            signal.alarm(0)
+
+
+def _address_space_bytes() -> int :
+    """ Current virtual memory size of this process; 0 if unknown """
+
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def _is_transient(
+    error: str
+) -> bool :
+    """ Whether an error (as reported by _extract_worker) may not recur """
+
+    if error is None:
+        return False
+    if error == WORKER_CRASHED:
+        return True
+    name = re.match(r"(\w+)(?: \((\w+)\))?:", error)
+    return name is not None and any(
+        n in _TRANSIENT_ERRORS for n in name.groups() if n is not None)
+
+
+_TRANSIENT_ERRORS = {ExtractionTimeout.__name__} | {
+    e.__name__ for e in [
+        OSError, BlockingIOError, ConnectionError, BrokenPipeError,
+        ConnectionAbortedError, ConnectionRefusedError, ConnectionResetError,
+        FileNotFoundError, InterruptedError, PermissionError, TimeoutError
+    ]
+}
@@ -0,0 +1,137 @@
+import json
+import logging
+import os
+import pathlib
+import threading
+
+logger = logging.getLogger("main.journal")
+
+JOURNAL_FILENAME = "scan.journal"
+
+
+def stat_signature(
+    filepath: pathlib.Path
+) -> list :
+    """ A cheap signature of a file's contents: [size, mtime in ns].
+
+    Obtained through os.stat; does not need to access file's contents.
+    A list (not tuple) so that it compares equal after a json round-trip.
+    """
+    st = os.stat(filepath)
+    return [st.st_size, st.st_mtime_ns]
+
+
+class ScanJournal:
+    """ Write-ahead journal of records extracted during a scan.
+
+    Each extracted record is appended as one json line, together with the
+    filename and stat signature of its file. Lines are buffered and flushed
+    (and fsync-ed) in batches, so that an interrupted scan loses at most one
+    batch of work.
+
+    The journal is stored in the report directory. It does not use the
+    `.jsonl` extension, so that it is never mistaken for a report.
+
+    Usage:
+        journal = ScanJournal(REPORT_DIR, resume=True)
+        rec = journal.lookup(fpath)   # journaled record, or None
+        journal.append(fpath, rec)
+        journal.close()               # flushes remaining records
+        journal.discard()             # once the report is committed
+    """
+
+    def __init__(
+        self,
+        directory: pathlib.Path,
+        resume: bool = False,
+        batch_size: int = 200
+    ):
+        self.path = directory/JOURNAL_FILENAME
+        self.batch_size = batch_size
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._entries = {}
+
+        if resume:
+            self._entries = self._load()
+            logger.info(
+                f"Resuming scan: {len(self._entries)} records journaled in {self.path}")
+            self._file = open(self.path, "a", encoding="utf8")
+            if self._file.tell() > 0 and not self._ends_with_newline():
+                # Terminate a torn last line, so that it does not swallow
+                # the next record
+                self._file.write("\n")
+        else:
+            self._file = open(self.path, "w", encoding="utf8")
+
+    def lookup(
+        self,
+        filepath: pathlib.Path
+    ) -> dict :
+        """ Returns the journaled record of filepath, if its stat signature
+        is unchanged since it was journaled. Otherwise None.
+        """
+        entry = self._entries.get(filepath.name)
+        if entry is not None and entry['sig'] == stat_signature(filepath):
+            return entry['record']
+        return None
+
+    def append(
+        self,
+        filepath: pathlib.Path,
+        record: dict
+    ) -> None :
+        """ Journal a record. Thread-safe. """
+        line = json.dumps(
+            {
+                'file': filepath.name,
+                'sig': stat_signature(filepath),
+                'record': record
+            },
+            ensure_ascii=False,
+            default=str
+        )
+        with self._lock:
+            self._buffer.append(line)
+            if len(self._buffer) >= self.batch_size:
+                self._flush()
+
+    def close(self) -> None :
+        with self._lock:
+            self._flush()
+            self._file.close()
+
+    def discard(self) -> None :
+        """ Remove the journal. Call once its records are committed. """
+        if not self._file.closed:
+            self.close()
+        self.path.unlink(missing_ok=True)
+        logger.debug(f"Journal {self.path} discarded")
+
+    def _flush(self) -> None :
+        if not self._buffer:
+            return
+        self._file.write("\n".join(self._buffer) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._buffer = []
+
+    def _ends_with_newline(self) -> bool :
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def _load(self) -> dict :
+        entries = {}
+        if not self.path.exists():
+            return entries
+        with open(self.path, "r", encoding="utf8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Last line may be torn if the scan was killed mid-write
+                    logger.warning(f"Skipping unreadable journal line in {self.path}")
+                    continue
+                entries[entry['file']] = entry
+        return entries
@@ -0,0 +1,119 @@
+from datetime import datetime, timedelta
+import json
+import logging
+import os
+import pathlib
+
+from .journal import stat_signature
+
+logger = logging.getLogger("main.quarantine")
+
+QUARANTINE_FILENAME = "quarantine.json"
+
+# Transient failures (e.g. timeouts on a slow NAS) are only skipped once they
+# recur this many times, and then only until the expiry below
+MAX_TRANSIENT_ATTEMPTS = 3
+TRANSIENT_EXPIRY = timedelta(days=7)
+
+
+class Quarantine:
+    """ Persistent list of files which failed tag extraction.
+
+    Each entry holds the file's stat signature at the time of failure and
+    the error reason. A quarantined file is skipped by subsequent scans
+    (negative cache) until its stat signature changes, i.e. until the file
+    is modified or replaced.
+
+    Transient failures (see extract_isolated()) are not negatively cached
+    outright. They are retried on each scan, until they have failed
+    MAX_TRANSIENT_ATTEMPTS times; then skipped until TRANSIENT_EXPIRY has
+    passed since the last failure.
+
+    Stored as json in the report directory. Written on every change, so the
+    list survives an interrupted scan.
+    """
+
+    def __init__(
+        self,
+        directory: pathlib.Path
+    ):
+        self.path = directory/QUARANTINE_FILENAME
+        self.entries = {}
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf8") as f:
+                self.entries = json.load(f)
+
+    def is_quarantined(
+        self,
+        filepath: pathlib.Path
+    ) -> bool :
+        entry = self.entries.get(filepath.name)
+        if entry is None or entry['sig'] != _signature_or_none(filepath):
+            return False
+        if not entry.get('transient', False):
+            return True
+
+        last = datetime.strptime(entry['last'], "%Y-%m-%d %H:%M:%S")
+        return entry['attempts'] >= MAX_TRANSIENT_ATTEMPTS \
+            and datetime.now() - last < TRANSIENT_EXPIRY
+
+    def add(
+        self,
+        filepath: pathlib.Path,
+        reason: str,
+        transient: bool = False
+    ) -> None :
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        sig = _signature_or_none(filepath)
+
+        prev = self.entries.get(filepath.name)
+        if prev is not None and prev['sig'] == sig:
+            since, attempts = prev['since'], prev.get('attempts', 1) + 1
+        else:
+            since, attempts = now, 1
+
+        self.entries[filepath.name] = {
+            'sig': sig,
+            'error': reason,
+            'transient': transient,
+            'attempts': attempts,
+            'since': since,
+            'last': now
+        }
+        self._save()
+
+    def release(
+        self,
+        filepath: pathlib.Path
+    ) -> None :
+        """ Remove filepath from quarantine, if it was quarantined """
+        if self.entries.pop(filepath.name, None) is not None:
+            logger.info(f"Released from quarantine: {filepath.name}")
+            self._save()
+
+    def prune(
+        self,
+        filenames: list
+    ) -> None :
+        """ Drop entries of files which are no longer in the library """
+        gone = set(self.entries) - set(filenames)
+        for f in gone:
+            del self.entries[f]
+        if gone:
+            self._save()
+
+    def _save(self) -> None :
+        tmp = self.path.with_name(f".{self.path.name}.tmp")
+        with open(tmp, "w", encoding="utf8") as f:
+            json.dump(self.entries, f, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+def _signature_or_none(
+    filepath: pathlib.Path
+) -> list :
+    """ stat_signature; None if the file cannot be stat-ed (e.g. NAS gone) """
+    try:
+        return stat_signature(filepath)
+    except OSError:
+        return None
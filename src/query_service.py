@@ -0,0 +1,316 @@
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import pathlib
+import re
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+
+from .date_utils import find_file_with_latest_dt_in_dir
+
+logger = logging.getLogger("main.query_service")
+
+DIFF_SUBDIR = "diffs"
+DT_FORMAT = "%Y-%m-%d %H-%M-%S" # as in report and diff filenames
+
+# Tags indexed for search
+SEARCH_COLS = ['Artist', 'Album', 'Title']
+
+
+class LibrarySnapshot:
+    """ A report (snapshot of the library) held in memory, with indexes.
+
+    - by_id: ID -> record (hash index)
+    - by_filename: Filename -> ID (hash index)
+    - inverted: token -> set of IDs; tokens of Artist, Album and Title
+
+    Read-only once built; so it can be shared by request threads without
+    locking.
+    """
+
+    def __init__(
+        self,
+        records: list,
+        name: str
+    ):
+        self.name = name
+        # Identifies the snapshot; used as ETag of responses derived from it
+        self.etag = f'"{_slug(name)}-{len(records)}"'
+
+        self.by_id = {}
+        self.by_filename = {}
+        self.inverted = {}
+        for r in records:
+            self.by_id[r['ID']] = r
+            self.by_filename[r['Filename']] = r['ID']
+            for col in SEARCH_COLS:
+                for token in _tokenize(r.get(col)):
+                    self.inverted.setdefault(token, set()).add(r['ID'])
+
+    @classmethod
+    def from_report(
+        cls,
+        fpath: pathlib.Path
+    ):
+        records = []
+        with open(fpath, "r", encoding="utf8") as f:
+            for line in f:
+                r = json.loads(line)
+                r.pop('Fingerprint', None) # only for diffing
+                r.pop('Agg_Fingerprint', None)
+                records.append(r)
+        return cls(records, name=fpath.stem)
+
+    def search(
+        self,
+        q: str,
+        limit: int = 50
+    ) -> list :
+        """ Records whose Artist/Album/Title contain all tokens of q """
+
+        tokens = _tokenize(q)
+        if not tokens:
+            return []
+        ids = set.intersection(*(self.inverted.get(t, set()) for t in tokens))
+        return [self.by_id[i] for i in sorted(ids)[:limit]]
+
+
+class DiffLog:
+    """ Diffs saved by main.py, as `diffs/diff <dt>.jsonl` in the report
+    directory. Files are immutable once written, so each is parsed once and
+    cached.
+    """
+
+    def __init__(
+        self,
+        directory: pathlib.Path
+    ):
+        self.directory = directory/DIFF_SUBDIR
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def since(
+        self,
+        dt: datetime
+    ) -> tuple :
+        """ Diff records made after dt, oldest first.
+
+        Returns:
+            (records, etag). etag identifies the latest diff file.
+        """
+
+        files = []
+        for fpath in sorted(self.directory.glob("diff *.jsonl")):
+            # A file is written after its records are made; so older files
+            # hold only older records
+            if _dt_in_name(fpath) >= dt:
+                files.append(fpath)
+
+        records = []
+        for fpath in files:
+            records += [r for r_dt, r in self._load(fpath) if r_dt > dt]
+
+        latest = files[-1].stem if files else "none"
+        return records, f'"{_slug(latest)}"'
+
+    def _load(
+        self,
+        fpath: pathlib.Path
+    ) -> list :
+        """ List of (datetime, record) of a diff file """
+        with self._lock:
+            if fpath not in self._cache:
+                with open(fpath, "r", encoding="utf8") as f:
+                    records = [json.loads(line) for line in f]
+                self._cache[fpath] = [
+                    (datetime.strptime(r['datetime'], DT_FORMAT), r)
+                    for r in records
+                ]
+            return self._cache[fpath]
+
+
+class QueryService:
+    """ Holds the latest snapshot of the report directory, and swaps it for
+    a newer one when a scan completes.
+
+    Reports are committed atomically (see write_report_atomic), so a report
+    found in the directory is always complete. The new snapshot is built
+    fully before it replaces the old one; requests in flight keep using the
+    snapshot they started with.
+
+    The directory may have no report yet (e.g. before the first scan);
+    snapshot is then None until the poller (see watch()) loads one.
+    """
+
+    def __init__(
+        self,
+        directory: pathlib.Path
+    ):
+        self.directory = directory
+        self.diffs = DiffLog(directory)
+        self.snapshot = None
+        self.refresh()
+
+    def refresh(self) -> bool :
+        """ Load the latest report, if it is not the one already held.
+
+        Returns:
+            True if the snapshot was swapped
+        """
+
+        try:
+            fpath = find_file_with_latest_dt_in_dir(
+                directory=self.directory,
+                re_search=r"\b20.*-\d\d",
+                ext="*.jsonl"
+            )
+        except ValueError: # max() of no reports
+            logger.info(f"No report in {self.directory} yet")
+            return False
+        if self.snapshot is not None and self.snapshot.name == fpath.stem:
+            return False
+
+        snapshot = LibrarySnapshot.from_report(fpath)
+        self.snapshot = snapshot # atomic swap
+        logger.info(f"Loaded snapshot {fpath} ({len(snapshot.by_id)} songs)")
+        return True
+
+    def watch(
+        self,
+        interval_s: int = 60
+    ) -> threading.Thread :
+        """ Poll for new reports in a daemon thread """
+
+        def _poll():
+            while True:
+                time.sleep(interval_s)
+                try:
+                    self.refresh()
+                except Exception:
+                    logger.exception("Failed to refresh snapshot")
+
+        th = threading.Thread(target=_poll, daemon=True)
+        th.start()
+        return th
+
+
+def make_server(
+    service: QueryService,
+    host: str = "0.0.0.0",
+    port: int = 8080
+) -> ThreadingHTTPServer :
+    """ HTTP server exposing service. Read-only; GET requests only.
+
+    Endpoints:
+        GET /songs/<ID>
+        GET /songs?filename=<Filename>
+        GET /search?q=<text>[&limit=<n>]   Artist/Album/Title, all tokens
+        GET /diff?since=<YYYY-MM-DD HH-MM-SS>
+
+    Responses carry an ETag. A request with a matching If-None-Match gets
+    304 Not Modified. Until a report is loaded, /songs and /search get
+    503 Service Unavailable.
+    """
+
+    class Handler(_Handler):
+        pass
+    Handler.service = service
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    service: QueryService = None
+
+    def do_GET(self):
+
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        snapshot = self.service.snapshot # fixed for this request
+
+        try:
+            if url.path == "/diff" and 'since' in params:
+                r, etag = self.service.diffs.since(
+                    datetime.strptime(params['since'], DT_FORMAT))
+                self._reply(r, etag)
+
+            elif snapshot is None and (
+                    url.path.startswith("/songs") or url.path == "/search"):
+                # No report loaded yet; diffs do not need one
+                self._send(503, {'error': "no report loaded yet"})
+
+            elif url.path.startswith("/songs/"):
+                r = snapshot.by_id.get(int(url.path[len("/songs/"):]))
+                self._reply(r, snapshot.etag)
+
+            elif url.path == "/songs" and 'filename' in params:
+                i = snapshot.by_filename.get(params['filename'])
+                self._reply(snapshot.by_id.get(i), snapshot.etag)
+
+            elif url.path == "/search" and 'q' in params:
+                r = snapshot.search(params['q'], int(params.get('limit', 50)))
+                self._reply(r, snapshot.etag)
+
+            else:
+                self._send(404, {'error': "not found"})
+
+        except ValueError as e:
+            self._send(400, {'error': str(e)})
+
+    def _reply(
+        self,
+        body,
+        etag: str
+    ) -> None :
+        if body is None:
+            self._send(404, {'error': "not found"})
+        elif self.headers.get('If-None-Match') == etag:
+            self._send(304, None, etag)
+        else:
+            self._send(200, body, etag)
+
+    def _send(
+        self,
+        status: int,
+        body,
+        etag: str = None
+    ) -> None :
+        self.send_response(status)
+        if etag is not None:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache') # always revalidate
+        if body is None:
+            self.end_headers()
+            return
+        data = json.dumps(body, ensure_ascii=False).encode('utf8')
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def _tokenize(
+    text: str
+) -> set :
+    if not isinstance(text, str):
+        return set()
+    return set(re.findall(r"\w+", text.lower()))
+
+
+def _slug(
+    text: str
+) -> str :
+    return re.sub(r"[^0-9A-Za-z-]", "", text)
+
+
+def _dt_in_name(
+    fpath: pathlib.Path
+) -> datetime :
+    return datetime.strptime(
+        re.search(r"\b20.*-\d\d", fpath.name).group(), DT_FORMAT)
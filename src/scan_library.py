@@ -1,16 +1,22 @@
 import logging
 import os
 import pathlib
-import threading
 import yaml
 
 import pandas as pd
 
 from .date_utils import num_mins_elapsed_since_last_modified, get_recent_df
-from .tag_extractor import song_tag_extractor
+from .extract_pool import extract_isolated
+from .journal import ScanJournal
+from .quarantine import Quarantine
+from .tag_extractor import sniff_format
 
 logger = logging.getLogger("main.scan_library")
 
+# Per-file limits on tag extraction
+FILE_TIMEOUT_S = 60
+FILE_MEMLIMIT_MB = 1024
+
 # Load Schemas
 with open("./src/schema.yaml", "r") as stream:
     yaml_gen = yaml.safe_load_all(stream) # load generator
@@ -48,10 +54,32 @@ def check_df_na(
 
 
 def full_scan(
-    path_to_lib: pathlib.Path
+    path_to_lib: pathlib.Path,
+    path_to_report_dir: pathlib.Path = None,
+    journal: ScanJournal = None,
+    quarantine: Quarantine = None,
+    file_timeout: int = FILE_TIMEOUT_S,
+    file_memlimit: int = FILE_MEMLIMIT_MB
 ) -> pd.DataFrame :
     """
 
+    Tags are extracted in isolated worker processes, see extract_isolated().
+    A file which fails extraction keeps its record of the latest report, if
+    it has one; else it is left out of the DataFrame. Either way, the scan
+    carries on. A summary of failures is logged at the end.
+
+    Args:
+        path_to_lib: Directory of the music library
+        path_to_report_dir: Directory of the reports. If given, the latest
+            report is the fallback of files which fail extraction
+        journal: If given, extracted records are journaled to it; files
+            already journaled with an unchanged stat signature are not
+            extracted again
+        quarantine: If given, failing files are added to it; files
+            quarantined with an unchanged stat signature are skipped
+        file_timeout: Max. seconds to spend extracting a single file
+        file_memlimit: Max. memory (MB) a worker may allocate
+
     Schema:
         - ID: int64
         - Title: object
@@ -95,33 +123,18 @@ def full_scan(
         pd.DataFrame containing the songs and their tags
     """
 
-    records = []
-
-    def _full_scan_thread(fpath: pathlib.Path):
-        """ Target function for a thread to execute
-        
-        Args:
-            fpath: Full path to (music) file
-        """
-        try:
-            records.append(song_tag_extractor(fpath))
-        except NotImplementedError:
-            logger.warning(
-                "Invalid file format (not .mp3/.flac) detected in" \
-                + f" {fpath}"
-            )
-
-    thread_ls = []
-    for f in os.listdir(path_to_lib)[:]:
-
-        th = threading.Thread(
-            target=_full_scan_thread, 
-            args=(path_to_lib/f, ))
-        thread_ls.append(th)
-        th.start()
-
-    for th in thread_ls:
-        th.join()
+    fallback = None
+    if path_to_report_dir is not None:
+        fallback = _load_cache(path_to_report_dir)
+
+    records = _extract_all(
+        paths=[path_to_lib/f for f in os.listdir(path_to_lib)],
+        journal=journal,
+        quarantine=quarantine,
+        file_timeout=file_timeout,
+        file_memlimit=file_memlimit,
+        fallback=fallback
+    )
 
     df = pd.DataFrame.from_records(records)
     df = df.astype(pd_schema_init).astype(pd_schema_completion) 
@@ -132,10 +145,16 @@ def full_scan(
 def cached_scan(
     path_to_lib: pathlib.Path,
     path_to_report_dir: pathlib.Path,
-    num_mins_thres: int = 5 * 24 * 60
+    num_mins_thres: int = 5 * 24 * 60,
+    journal: ScanJournal = None,
+    quarantine: Quarantine = None,
+    file_timeout: int = FILE_TIMEOUT_S,
+    file_memlimit: int = FILE_MEMLIMIT_MB
 ) -> pd.DataFrame :
     """
 
+    Args: See fn full_scan() above
+
     Schema: See fn full_scan() above
 
     Remarks: See fn full_scan() above
@@ -144,16 +163,12 @@ def cached_scan(
         pd.DataFrame containing the songs and their tags
     """
 
-    cache = get_recent_df(path_to_report_dir)
-    cache = cache.set_index(
-        keys='Filename',
-        drop=False,
-        append=False
-    )
-
-    logger.debug(f"cache retrieved from {path_to_report_dir}")
+    cache = _load_cache(path_to_report_dir)
+    if cache is None:
+        raise FileNotFoundError(f"No report in {path_to_report_dir} to use as cache")
 
     records = []
+    to_extract = []
 
     for f in os.listdir(path_to_lib)[:]:
 
@@ -161,15 +176,23 @@ def cached_scan(
             cached_tags: dict = cache.loc[f].to_dict()
 
             if num_mins_elapsed_since_last_modified(path_to_lib/f) < num_mins_thres:
-                records.append(song_tag_extractor(path_to_lib/f))
+                to_extract.append(path_to_lib/f)
 
             else:
                 records.append(cached_tags)
 
         except KeyError: # not cached
-            records.append(song_tag_extractor(path_to_lib/f))
+            to_extract.append(path_to_lib/f)
             logger.info(f"Not in cache: Possible new song found: {f}")
 
+    records += _extract_all(
+        paths=to_extract,
+        journal=journal,
+        quarantine=quarantine,
+        file_timeout=file_timeout,
+        file_memlimit=file_memlimit,
+        fallback=cache
+    )
 
     df = pd.DataFrame.from_records(records)
     df = df.astype(pd_schema_init).astype(pd_schema_completion) 
@@ -177,3 +200,134 @@ def cached_scan(
 
     return df
 
+
+def _load_cache(
+    path_to_report_dir: pathlib.Path
+) -> pd.DataFrame :
+    """ Latest report, indexed by Filename; None if there is no report """
+
+    try:
+        cache = get_recent_df(path_to_report_dir)
+    except ValueError: # max() of no reports
+        logger.info(f"No report in {path_to_report_dir}")
+        return None
+
+    # Fingerprints are only for diffing; not part of the schema
+    cache = cache.drop(columns=['Fingerprint', 'Agg_Fingerprint'], errors='ignore')
+    cache = cache.set_index(
+        keys='Filename',
+        drop=False,
+        append=False
+    )
+
+    logger.debug(f"cache retrieved from {path_to_report_dir}")
+    return cache
+
+
+def _extract_all(
+    paths: list,
+    journal: ScanJournal = None,
+    quarantine: Quarantine = None,
+    file_timeout: int = FILE_TIMEOUT_S,
+    file_memlimit: int = FILE_MEMLIMIT_MB,
+    fallback: pd.DataFrame = None
+) -> list :
+    """ Extract tags of files in paths, going through journal and quarantine
+
+    Args:
+        fallback: Previous records, indexed by Filename. A file which fails
+            extraction, or is skipped as quarantined, keeps its previous
+            record (if any) rather than dropping out of the library
+
+    Returns:
+        List of records (dict) of files successfully extracted, or of
+        their fallback records
+    """
+
+    records = []
+    pending = []
+    skipped = []
+
+    for fpath in paths:
+        record = journal.lookup(fpath) if journal is not None else None
+        if record is not None:
+            records.append(record)
+        elif quarantine is not None and quarantine.is_quarantined(fpath):
+            skipped.append(fpath)
+        else:
+            pending.append(fpath)
+
+    if skipped:
+        logger.info(f"Skipped {len(skipped)} quarantined files (unchanged since failure)")
+
+    extracted = set()
+    failures = {}
+    for fpath, record, error, transient in extract_isolated(
+        _discover(pending, quarantine),
+        timeout_s=file_timeout,
+        mem_limit_mb=file_memlimit
+    ):
+        if error is not None:
+            failures[fpath.name] = error
+            if quarantine is not None:
+                quarantine.add(fpath, error, transient=transient)
+            continue
+
+        extracted.add(fpath.name)
+        records.append(record)
+        if journal is not None:
+            journal.append(fpath, record)
+        if quarantine is not None:
+            quarantine.release(fpath)
+
+    # Failure summary
+    if failures:
+        logger.warning(f"{len(failures)} files failed tag extraction:")
+        for f, error in failures.items():
+            logger.warning(f"  {f}: {error}")
+
+    # Files not extracted (failed, quarantined or unsupported) keep their
+    # previous record; else they would be reported as deleted
+    if fallback is not None:
+        kept = [
+            fpath.name for fpath in skipped + pending
+            if fpath.name not in extracted and fpath.name in fallback.index
+        ]
+        records += fallback.loc[kept].to_dict('records')
+        if kept:
+            logger.info(f"Kept previous tags of {len(kept)} files not extracted")
+
+    return records
+
+
+def _discover(
+    paths: list,
+    quarantine: Quarantine = None
+) -> list :
+    """ Identify the format of each file by sniffing its magic bytes.
+
+    Files of unsupported format are not returned, so they are never
+    scheduled onto workers. They are quarantined (if there is a quarantine),
+    so they are not sniffed again until they change.
+
+    Returns:
+        List of (fpath, fmt) tuples
+    """
+
+    jobs = []
+    unsupported = []
+    for fpath in paths:
+        if fpath.is_dir():
+            continue
+        fmt = sniff_format(fpath)
+        if fmt is None:
+            unsupported.append(fpath.name)
+            if quarantine is not None:
+                quarantine.add(fpath, "Unsupported format")
+        else:
+            jobs.append((fpath, fmt))
+
+    if unsupported:
+        logger.warning(
+            f"{len(unsupported)} files of unsupported format: {unsupported}")
+    return jobs
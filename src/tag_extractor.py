@@ -1,22 +1,107 @@
+from collections import namedtuple
 from datetime import datetime
 import pathlib
+import yaml
 
 from mutagen.flac import FLAC
+from mutagen.id3 import ID3
 from mutagen.mp3 import MP3, EasyMP3 as EMP3
+from mutagen.mp4 import MP4
+from mutagen.oggopus import OggOpus
+from mutagen.oggvorbis import OggVorbis
 
+# Load tag mappings (5th YAML document)
+with open("./src/schema.yaml", "r") as stream:
+    yaml_gen = yaml.safe_load_all(stream) # load generator
+    for _ in range(4):
+        _ = next(yaml_gen)
+    tag_mappings = next(yaml_gen)['tag_mappings']
 
-def song_tag_extractor(
+
+# A supported format.
+#   name: Also the value of the `Extension` tag
+#   extensions: File extensions (lower-case) usually used by the format.
+#       Only a hint, for which sniffers to try first.
+#   sniff: fn(head: bytes) -> bool. head is the start of the file, after any
+#       ID3v2 tags.
+#   extract: fn(filepath, name) -> dict. See song_tag_extractor().
+Extractor = namedtuple('Extractor', ['name', 'extensions', 'sniff', 'extract'])
+
+EXTRACTORS = {}
+
+# No. of bytes read (after any ID3v2 tags) for sniffing. MP3 has no magic of
+# its own; its first frame may follow padding, so a window is scanned for it
+SNIFF_LEN = 8192
+# No. of bytes read when nothing matched SNIFF_LEN bytes; only the format of
+# the file's extension is tried on them
+SNIFF_LEN_EXTENDED = 1024 * 1024
+# No. of consecutive frames which identify MP3
+MP3_MIN_FRAMES = 3
+# Major brands (of the `ftyp` box) of MPEG-4 files which may be audio. Others
+# (e.g. `heic`, `avif`, `qt  `) are images or video
+M4A_BRANDS = {b"M4A ", b"M4B ", b"M4P ", b"F4A ", b"mp41", b"mp42", b"isom", b"iso2", b"dash"}
+
+
+def register_extractor(
+    name: str,
+    extensions: tuple,
+    sniff,
+    extract
+) -> None :
+    """ Register a format with its sniffing and extraction functions.
+    See Extractor above.
+    """
+    EXTRACTORS[name] = Extractor(name, extensions, sniff, extract)
+
+
+def sniff_format(
     filepath: pathlib.Path
+) -> str :
+    """ Identify the format of a file by its magic bytes.
+
+    Reads only the first few KB of the file. The registered format of the
+    file's extension is tried first; the others only if it does not match.
+    So a mis-named or upper-case-extension file is still identified. If
+    none matches, the format of the extension is tried once more on the
+    first SNIFF_LEN_EXTENDED bytes (e.g. an .mp3 whose first frame follows
+    a lot of padding).
+
+    Returns:
+        Name of the registered format, or None if none matches
+    """
+
+    head = _read_head(filepath)
+    if head is None:
+        return None
+
+    ext = filepath.suffix.lower()
+    ordered = sorted(EXTRACTORS.values(), key=lambda e: ext not in e.extensions)
+    for e in ordered:
+        if e.sniff(head):
+            return e.name
+
+    if ordered and ext in ordered[0].extensions:
+        head = _read_head(filepath, SNIFF_LEN_EXTENDED)
+        if head is not None and ordered[0].sniff(head):
+            return ordered[0].name
+    return None
+
+
+def song_tag_extractor(
+    filepath: pathlib.Path,
+    fmt: str = None
 ) -> dict:
     """ Extracts tags of interest of a music file into a dictionary.
-    Supported types: .flac, .mp3.
+    Supported types: see EXTRACTORS (.flac, .mp3, .m4a, .ogg, .opus).
 
-    This function DOES NOT modify the tags of the file. It is read-only. 
+    This function DOES NOT modify the tags of the file. It is read-only.
 
     Args:
-        filepath: A pathlib.Path object of absolute path to .flac file. 
-    
-    Returns: 
+        filepath: A pathlib.Path object of absolute path to music file.
+        fmt: Name of the registered format of the file. If None, it is
+            sniffed from the file.
+
+    Returns:
         A dictionary containing the following (22) keys:
         - ID: int
         - Title: str
@@ -45,58 +130,69 @@ def song_tag_extractor(
         contains are all un-nested.
 
     Raises:
-        ValueError: If filepath does not lead to supported file extension.
-    
+        NotImplementedError: If file is not of a supported format.
+
     """
-    if filepath.suffix == '.flac':
-        return _flac_extractor(filepath)
-    elif filepath.suffix == '.mp3':
-        return _mp3_extractor(filepath)
-    else:
-        raise NotImplementedError("does not support non .flac or .mp3 files")
+    if fmt is None:
+        fmt = sniff_format(filepath)
+    if fmt not in EXTRACTORS:
+        raise NotImplementedError(
+            f"unsupported format; supports {', '.join(EXTRACTORS)}")
+    return EXTRACTORS[fmt].extract(filepath, fmt)
 
 
-def _flac_extractor(
-    filepath: pathlib.Path
+def _read_head(
+    filepath: pathlib.Path,
+    n: int = SNIFF_LEN
+) -> bytes :
+    """ Read the first n bytes of a file, skipping any ID3v2 tags
+    (some taggers prepend a tag without removing the old one). None if the
+    file cannot be read.
+    """
+    try:
+        with open(filepath, "rb") as f:
+            offset = 0
+            head = f.read(10)
+            while head[:3] == b"ID3" and len(head) == 10:
+                # ID3v2 size is a 28-bit synchsafe integer; excludes header
+                # and footer (v2.4, flag 0x10), both 10 bytes
+                size = 0
+                for b in head[6:10]:
+                    size = (size << 7) | (b & 0x7F)
+                offset += 10 + size + (10 if head[5] & 0x10 else 0)
+                f.seek(offset)
+                head = f.read(10)
+            return head + f.read(n - len(head))
+    except OSError:
+        return None
+
+
+def _map_tags(
+    lookup,
+    mapper: dict
 ) -> dict :
-    """ Extracts tags of interest of a .flac file into a dictionary.
+    """ Map tags of a file into a dictionary, per mapper.
 
+    Args:
+        lookup: fn(key) -> list of str. Values of a tag of the file.
+        mapper: Tag (see song_tag_extractor()) -> key of the tag in the file
     """
-    
-    file = FLAC(f"{filepath}")
+
     out = {}
-    
-    mapper = {
-        'ID': 'song_id',
-        'Title': 'title',
-        'Artist': 'artist',
-        'Album_Artist': 'albumartist',
-        'Album': 'album',
-        'Genre': 'genre',
-        'BPM': 'bpm',
-        'Key': 'initial key',
-        'Year': 'date',
-        'Rating': 'rating',
-        'Language': 'language',
-        'Gender': 'copyright',
-        'DateAdded': 'encodingtime',
-        'Energy': 'energy',
-        'KPlay': 'kplay',
-    }
-    
+
     for Tag in mapper.keys():
         try:
-            t = file[mapper[Tag]]
-            
+            t = lookup(mapper[Tag])
+
             if Tag == 'Artist':
                 out['Artist'] = "; ".join(t)
-            
+
             elif Tag == 'Genre':
                 if len(t) == 2:
                     out['Major_Genre'], out['Minor_Genre'] = t[0], t[1]
                 else:
                     out['Major_Genre'], out['Minor_Genre'] = t[0], None
-                    
+
             elif Tag == 'Language':
                 if len(t) == 2:
                     out['Major_Language'], out['Minor_Language'] = t[0], t[1]
@@ -105,124 +201,225 @@ def _flac_extractor(
 
             elif Tag == 'Rating':
                 out['Rating'] = float(t[0]) / 20.0
-                
+
             elif Tag == 'DateAdded':
                 out['DateAdded'] = \
                     datetime.strptime(t[0], '%d/%m/%Y').strftime("%Y-%m-%d")
-                      
+
             else: # all other Tags
                 out[Tag] = t[0]
-                
-        # Some tags are empty. Like 'energy' and 'kplay'. 
+
+        # Some tags are empty. Like 'energy' and 'kplay'.
         # So an except block to catch these and give them None value.
-        except:
-            out[Tag] = None
-            
+        except Exception:
+            if Tag in ('Genre', 'Language'):
+                out[f'Major_{Tag}'] = out[f'Minor_{Tag}'] = None
+            else:
+                out[Tag] = None
+
+    return out
+
+
+def _file_info(
+    file,
+    filepath: pathlib.Path,
+    name: str
+) -> dict :
+    """ Tags common to all formats, which are not read from the tags """
+
+    out = {}
     out['Time'] = file.info.length
-    out['Bitrate'] = file.info.bitrate
-    out['Extension'] = 'flac'
+    # Not all formats report a bitrate (e.g. opus); estimate from file size
+    out['Bitrate'] = getattr(file.info, 'bitrate', 0)
+    if not out['Bitrate'] and file.info.length:
+        out['Bitrate'] = int(filepath.stat().st_size * 8 / file.info.length)
+    out['Extension'] = name
     out['Filename'] = filepath.name
 
     out['Report_Time'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
     return out
 
+
+def _vorbis_extractor(
+    filepath: pathlib.Path,
+    name: str
+) -> dict :
+    """ Extracts tags of interest of a file tagged with Vorbis comments
+    (.flac, .ogg, .opus) into a dictionary.
+
+    """
+
+    file = {'flac': FLAC, 'ogg': OggVorbis, 'opus': OggOpus}[name](f"{filepath}")
+
+    out = _map_tags(lambda k: file[k], tag_mappings['vorbis'])
+    out.update(_file_info(file, filepath, name))
+
+    return out
+
+
+def _mp4_extractor(
+    filepath: pathlib.Path,
+    name: str
+) -> dict :
+    """ Extracts tags of interest of a .m4a file into a dictionary.
+
+    """
+
+    file = MP4(f"{filepath}")
+
+    def _lookup(key):
+        # Freeform atoms hold bytes; tmpo holds ints
+        return [
+            v.decode('utf8') if isinstance(v, bytes) else str(v)
+            for v in file.tags[key]
+        ]
+
+    out = _map_tags(_lookup, tag_mappings['mp4'])
+    out.update(_file_info(file, filepath, name))
+
+    return out
+
+
 def _mp3_extractor(
-    filepath: pathlib.Path
+    filepath: pathlib.Path,
+    name: str
 ) -> dict:
     """ Extracts tags of interest of a .mp3 file into a dictionary.
 
     """
-    
-    out = {}
-    
+
     file = EMP3(f"{filepath}")
-    
-    mapper = {
-        'Title': 'title',
-        'Artist': 'artist',
-        'Album_Artist': 'albumartist',
-        'Album': 'album',
-        'Genre': 'genre',
-        'BPM': 'bpm',
-        'Year': 'date',
-        'Language': 'language',
-        'Gender': 'copyright',
-    }
-    
-    for Tag in mapper.keys():
-        try:
-            t = file[mapper[Tag]]
-            
-            if Tag == 'Artist':
-                out['Artist'] = "; ".join(t)
-            
-            elif Tag == 'Genre':
-                if len(t) == 2:
-                    out['Major_Genre'], out['Minor_Genre'] = t[0], t[1]
-                else:
-                    out['Major_Genre'], out['Minor_Genre'] = t[0], None
-                    
-            elif Tag == 'Language':
-                if len(t) == 2:
-                    out['Major_Language'], out['Minor_Language'] = t[0], t[1]
-                else:
-                    out['Major_Language'], out['Minor_Language'] = t[0], None
-                
-            elif Tag == 'Rating':
-                out[Tag] = t[0] / 20.0
-            else: # all other Tags
-                out[Tag] = t[0]
-        except KeyError:
-            out[Tag] = None
 
-    # MP3 != EMP3. MP3 is more "dirty" compared to EMP3, but it has everything. 
-    file = MP3(f"{filepath}")  
+    out = _map_tags(lambda k: file[k], tag_mappings['id3'])
+
+    # MP3 != EMP3. MP3 is more "dirty" compared to EMP3, but it has everything.
+    file = MP3(f"{filepath}")
+    # A file without an ID3 tag has tags None; read it as empty
+    tags = file.tags if file.tags is not None else ID3()
 
+    txxx = {v: k for k, v in tag_mappings['id3_txxx'].items()}
     out['Energy'] = out['DateAdded'] = out['KPlay'] = None
-    for t in file.tags.getall('TXXX'):
-        if   t.desc == "SONG_ID":
-            out['ID'] = t.text[0]
-        elif t.desc == 'EnergyLevel':
-            out['Energy'] = t.text[0]
-        elif t.desc == 'ENCODINGTIME':
+    for t in tags.getall('TXXX'):
+        Tag = txxx.get(t.desc)
+        if Tag == 'DateAdded':
             out['DateAdded'] = datetime.strptime(t.text[0], '%d/%m/%Y').strftime("%Y-%m-%d")
-        elif t.desc == 'KPLAY':
-            out['KPlay'] = t.text[0]
-        else:
-            pass
+        elif Tag is not None:
+            out[Tag] = t.text[0]
+
+    # Like .flac, a missing key is left as None rather than raising
+    tkey = tags.getall('TKEY')
+    out['Key'] = tkey[0].text[0] if tkey else None
 
-    out['Key'] = file.tags.getall('TKEY')[0].text[0]
-    
-    def _mp3rating(mutagen_mp3):
-        """ Converts mp3 internal rating-values to proper no. of stars. 
+    def _mp3rating(id3):
+        """ Converts mp3 internal rating-values to proper no. of stars.
 
         This is a simple helper function meant to specfically adress the weird
         rating storage in .mp3 files. It has no need to exist outside of this
         scope.
-        
+
         Args:
-            mutagen_mp3: mutagen.mp3.MP3
+            id3: mutagen.id3.ID3, the tags of the file
 
         Returns:
             A float value, representing the number of stars rated in this song,
-             following the 5-star rating system.
+             following the 5-star rating system. 0.0 if unrated (no POPM).
         """
+        popm = id3.getall('POPM')
+        if not popm:
+            return 0.0
         try:
             rating_map = {
-                13: 0.5, 1: 1.0, 54: 1.5, 64: 2.0, 118: 2.5, 
+                13: 0.5, 1: 1.0, 54: 1.5, 64: 2.0, 118: 2.5,
                 128: 3.0, 186: 3.5, 196: 4.0, 242: 4.5, 255: 5.0
             }
-            return rating_map[mutagen_mp3.tags.getall('POPM')[0].rating]
+            return rating_map[popm[0].rating]
         except KeyError:
             return 0.0
-    
-    out['Rating'] = _mp3rating(file)     
-    out['Time'] = file.info.length
-    out['Bitrate'] = file.info.bitrate
-    out['Extension'] = 'mp3'
-    out['Filename'] = filepath.name
 
-    out['Report_Time'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-             
+    out['Rating'] = _mp3rating(tags)
+    out.update(_file_info(file, filepath, name))
+
     return out
+
+
+def _is_mp3(
+    head: bytes
+) -> bool :
+    """ Whether head holds the headers of MP3_MIN_FRAMES consecutive MPEG
+    audio frames. Frames may be preceded by padding or junk; a single
+    valid-looking header in it is not enough.
+    """
+
+    i = head.find(b"\xFF")
+    while i >= 0:
+        j = i
+        for _ in range(MP3_MIN_FRAMES):
+            n = _mp3_frame_len(head[j:j + 4])
+            if n is None:
+                break
+            j += n
+        else:
+            return True
+        i = head.find(b"\xFF", i + 1)
+    return False
+
+
+# MPEG audio header tables, by (version is MPEG1, layer); kbps and Hz
+_MP3_BITRATES = {
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_MP3_SAMPLERATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+
+def _mp3_frame_len(
+    header: bytes
+) -> int :
+    """ Length in bytes of the MPEG audio frame of a 4-byte header; None if
+    it is not a valid header (or is free-format)
+    """
+
+    if len(header) < 4 or header[0] != 0xFF or (header[1] & 0xE0) != 0xE0:
+        return None
+    version = (header[1] >> 3) & 0x03 # 3: MPEG1, 2: MPEG2, 0: MPEG2.5
+    layer = 4 - ((header[1] >> 1) & 0x03)
+    bitrate_idx = header[2] >> 4
+    samplerate_idx = (header[2] >> 2) & 0x03
+    if version == 1 or layer == 4 or bitrate_idx in (0, 15) or samplerate_idx == 3:
+        return None
+
+    bitrate = _MP3_BITRATES[(version == 3, layer)][bitrate_idx] * 1000
+    samplerate = _MP3_SAMPLERATES[version][samplerate_idx]
+    padding = (header[2] >> 1) & 0x01
+    if layer == 1:
+        return (12 * bitrate // samplerate + padding) * 4
+    if layer == 3 and version != 3:
+        return 72 * bitrate // samplerate + padding
+    return 144 * bitrate // samplerate + padding
+
+
+register_extractor(
+    'flac', ('.flac', ),
+    lambda head: head[:4] == b"fLaC",
+    _vorbis_extractor)
+register_extractor(
+    'mp3', ('.mp3', ),
+    _is_mp3,
+    _mp3_extractor)
+register_extractor(
+    'm4a', ('.m4a', '.mp4', '.m4b'),
+    lambda head: head[4:8] == b"ftyp" and head[8:12] in M4A_BRANDS,
+    _mp4_extractor)
+register_extractor(
+    'ogg', ('.ogg', '.oga'),
+    lambda head: head[:4] == b"OggS" and head[28:35] == b"\x01vorbis",
+    _vorbis_extractor)
+register_extractor(
+    'opus', ('.opus', ),
+    lambda head: head[:4] == b"OggS" and head[28:36] == b"OpusHead",
+    _vorbis_extractor)
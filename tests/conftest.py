@@ -0,0 +1,11 @@
+import os
+import pathlib
+import sys
+
+# Modules of src/ read ./src/schema.yaml on import; run from repo root
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+os.chdir(ROOT)
+sys.path.insert(0, str(ROOT))
+
+# Read by src/diff_creator.py on import; tests pass their directories
+os.environ.setdefault('REPORT_TARGET', str(ROOT))
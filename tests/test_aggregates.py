@@ -0,0 +1,65 @@
+""" Incremental aggregates against a full recompute, with the old snapshot
+read back from its saved report (as main.py does).
+"""
+import pandas as pd
+
+from src.aggregates import compute_aggregates, maintain_aggregates, save_aggregates, _compare_aggregates
+from src.date_utils import fingerprints_path, write_report_atomic
+from src.diff_creator import get_diff_pdf, get_old_fingerprints, report_fingerprints
+
+
+def library(n: int) -> pd.DataFrame :
+
+    return pd.DataFrame({
+        'ID': range(n),
+        'Filename': [f"{i}.flac" for i in range(n)],
+        'Major_Genre': ["Pop", "Rock"] * (n // 2),
+        'Minor_Genre': [None] * n,
+        # Whole numbers only; read_json reads them back as int
+        'Rating': [float(i % 5) for i in range(n)],
+        'KPlay': pd.array([i % 3 or None for i in range(n)], dtype="Int64"),
+        'Time': [180.123456789 + i for i in range(n)],
+        'Major_Language': ["English", "Japanese"] * (n // 2),
+        'Gender': ["Male", "Female", None, "Mixed"] * (n // 4),
+    })
+
+
+def save_report(
+    df: pd.DataFrame,
+    fpath
+) -> None :
+    """ As main.py does """
+    write_report_atomic(df, fpath)
+    write_report_atomic(report_fingerprints(df), fingerprints_path(fpath))
+
+
+def modified(old: pd.DataFrame) -> pd.DataFrame :
+
+    new = old.drop(index=[0, 1]) # deleted
+    new = pd.concat([new, library(44).iloc[40:]], ignore_index=True) # inserted
+    new.loc[new['ID'] == 2, 'Rating'] = 1.0 # tracked by the diff
+    new.loc[new['ID'] == 3, 'Gender'] = "Female" # not tracked
+    new.loc[new['ID'] == 4, 'Time'] = 1.0
+    new.loc[new['ID'] == 5, 'Major_Language'] = None
+    return new
+
+
+def test_incremental_matches_full_recompute(tmp_path):
+
+    old = library(40)
+    old_report = tmp_path/"report 2026-01-01 00-00-00.jsonl"
+    save_report(old, old_report)
+    aggs = compute_aggregates(old)
+    aggs['Report'] = old_report.name
+    save_aggregates(aggs, tmp_path)
+
+    new = modified(old)
+    old_fps = get_old_fingerprints(old_report)
+    diff = get_diff_pdf(new, old_report=old_report, old_fps=old_fps)
+
+    aggs = maintain_aggregates(
+        tmp_path, diff, old_report, old_fps, new, "report 2026-01-02 00-00-00.jsonl")
+
+    assert aggs['Runs_Since_Recompute'] == 1 # i.e. updated, not recomputed
+    assert _compare_aggregates(aggs, compute_aggregates(new)) == []
+    assert all(v > 0 for v in aggs['Rating'].values())
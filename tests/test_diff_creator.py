@@ -0,0 +1,54 @@
+""" Diffing against the fingerprints file of the old report """
+import pandas as pd
+
+from src import diff_creator
+from src.date_utils import fingerprints_path, write_report_atomic
+from src.diff_creator import get_diff_pdf, get_old_fingerprints, get_recent_report_path
+
+from .test_aggregates import library, modified, save_report
+
+
+def _ops(diff: pd.DataFrame) -> set :
+    return {
+        (r['op'], r['id'], r.get('field_name') if r['op'] == 'upd' else None)
+        for r in diff.to_dict('records')
+    }
+
+
+def test_diff_reads_only_changed_rows(tmp_path, monkeypatch):
+
+    old = library(40)
+    old_report = tmp_path/"report 2026-01-01 00-00-00.jsonl"
+    save_report(old, old_report)
+    assert get_recent_report_path(tmp_path) == old_report # not the .fp.jsonl
+
+    read = []
+    read_report_rows = diff_creator.read_report_rows
+    def _read_report_rows(report, lines):
+        read.extend(lines)
+        return read_report_rows(report, lines)
+    monkeypatch.setattr(diff_creator, 'read_report_rows', _read_report_rows)
+
+    diff = get_diff_pdf(modified(old), old_report=old_report)
+
+    assert _ops(diff) == {
+        ('del', 0, None), ('del', 1, None),
+        ('ins', 40, None), ('ins', 41, None), ('ins', 42, None), ('ins', 43, None),
+        ('upd', 2, 'Rating'),
+    }
+    assert sorted(read) == [0, 1, 2] # lines of the deleted and changed IDs
+
+
+def test_report_without_fingerprints_file(tmp_path):
+
+    old = library(40)
+    old_report = tmp_path/"report 2026-01-01 00-00-00.jsonl"
+    write_report_atomic(old, old_report) # as saved before fingerprints files
+    assert not fingerprints_path(old_report).exists()
+
+    fps = get_old_fingerprints(old_report)
+    assert list(fps.index) == list(range(40))
+    assert fps['Agg_Fingerprint'].isna().all() # aggregates are recomputed
+
+    diff = get_diff_pdf(modified(old), old_report=old_report, old_fps=fps)
+    assert ('upd', 2, 'Rating') in _ops(diff)
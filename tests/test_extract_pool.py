@@ -0,0 +1,81 @@
+""" Isolation of tag extraction in worker processes.
+
+Uses fake formats, registered with register_extractor(). Workers are
+forked, so they see the registrations.
+"""
+import os
+import time
+
+import pytest
+
+from src.extract_pool import WORKER_CRASHED, extract_isolated
+from src.tag_extractor import register_extractor
+
+
+def _ok(filepath, name):
+    return {'Filename': filepath.name}
+
+
+def _slow(filepath, name):
+    time.sleep(30)
+
+
+def _crash(filepath, name):
+    os._exit(1) # as if killed by the OS
+
+
+def _raise(filepath, name):
+    raise ValueError("bad tag")
+
+
+def _oserror(filepath, name):
+    raise OSError(5, "Input/output error")
+
+
+for _name, _fn in [
+    ('test_ok', _ok), ('test_slow', _slow), ('test_crash', _crash),
+    ('test_raise', _raise), ('test_oserror', _oserror)
+]:
+    register_extractor(_name, (), lambda head: False, _fn)
+
+
+def _run(tmp_path, fmts, **kwargs) -> dict :
+    jobs = [(tmp_path/f"{i}.{fmt}", fmt) for i, fmt in enumerate(fmts)]
+    results = {}
+    for fpath, record, error, transient in extract_isolated(jobs, **kwargs):
+        assert fpath not in results # each file exactly once
+        results[fpath] = (record, error, transient)
+    assert set(results) == {p for p, _ in jobs}
+    return {p.name: r for p, r in results.items()}
+
+
+def test_errors_are_reported(tmp_path):
+
+    results = _run(tmp_path, ['test_ok', 'test_raise', 'test_oserror'], max_workers=2)
+
+    assert results['0.test_ok'] == ({'Filename': "0.test_ok"}, None, False)
+    assert results['1.test_raise'] == (None, "ValueError: bad tag", False)
+    record, error, transient = results['2.test_oserror']
+    assert error.startswith("OSError") and transient
+
+
+def test_timeout(tmp_path):
+
+    t = time.monotonic()
+    results = _run(tmp_path, ['test_slow', 'test_ok'], timeout_s=1, max_workers=2)
+
+    assert time.monotonic() - t < 15
+    record, error, transient = results['0.test_slow']
+    assert error.startswith("ExtractionTimeout") and transient
+    assert results['1.test_ok'][1] is None
+
+
+@pytest.mark.parametrize("crash_at", [0, 7, 29])
+def test_crash_fails_only_the_crashing_file(tmp_path, crash_at):
+
+    fmts = ['test_ok'] * 30
+    fmts[crash_at] = 'test_crash'
+    results = _run(tmp_path, fmts, max_workers=3)
+
+    crashed = {f: r for f, r in results.items() if r[1] is not None}
+    assert crashed == {f"{crash_at}.test_crash": (None, WORKER_CRASHED, True)}
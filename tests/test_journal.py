@@ -0,0 +1,61 @@
+""" Resuming a scan from its journal """
+from src.journal import ScanJournal
+
+
+def _songs(tmp_path, n: int) -> list :
+    paths = []
+    for i in range(n):
+        p = tmp_path/f"{i}.flac"
+        p.write_bytes(b"x" * (i + 1))
+        paths.append(p)
+    return paths
+
+
+def test_resume_after_torn_line(tmp_path):
+
+    paths = _songs(tmp_path, 4)
+
+    journal = ScanJournal(tmp_path, batch_size=2)
+    for p in paths[:3]:
+        journal.append(p, {'Filename': p.name})
+    journal.close()
+    # Killed mid-write of the 4th record
+    with open(journal.path, "a", encoding="utf8") as f:
+        f.write('{"file": "3.flac", "sig": [4, ')
+
+    journal = ScanJournal(tmp_path, resume=True)
+    assert [journal.lookup(p) for p in paths] == [
+        {'Filename': "0.flac"}, {'Filename': "1.flac"}, {'Filename': "2.flac"}, None]
+
+    # Appended after the torn line, not swallowed by it
+    journal.append(paths[3], {'Filename': "3.flac"})
+    journal.close()
+    journal = ScanJournal(tmp_path, resume=True)
+    assert journal.lookup(paths[3]) == {'Filename': "3.flac"}
+    journal.close()
+
+
+def test_changed_file_is_not_resumed(tmp_path):
+
+    p, = _songs(tmp_path, 1)
+    journal = ScanJournal(tmp_path)
+    journal.append(p, {'Filename': p.name})
+    journal.close()
+
+    p.write_bytes(b"changed")
+    journal = ScanJournal(tmp_path, resume=True)
+    assert journal.lookup(p) is None
+    journal.close()
+
+
+def test_no_resume_starts_afresh(tmp_path):
+
+    p, = _songs(tmp_path, 1)
+    journal = ScanJournal(tmp_path)
+    journal.append(p, {'Filename': p.name})
+    journal.close()
+
+    journal = ScanJournal(tmp_path)
+    assert journal.lookup(p) is None
+    journal.discard()
+    assert not journal.path.exists()
@@ -0,0 +1,73 @@
+""" Negative cache of failing files """
+from datetime import datetime, timedelta
+
+from src.quarantine import Quarantine, MAX_TRANSIENT_ATTEMPTS, TRANSIENT_EXPIRY
+
+
+def _song(tmp_path):
+    p = tmp_path/"song.flac"
+    p.write_bytes(b"broken")
+    return p
+
+
+def test_permanent_failure_until_file_changes(tmp_path):
+
+    p = _song(tmp_path)
+    Quarantine(tmp_path).add(p, "FLACNoHeaderError: not a flac")
+
+    quarantine = Quarantine(tmp_path) # persisted
+    assert quarantine.is_quarantined(p)
+
+    p.write_bytes(b"fixed, with new tags")
+    assert not quarantine.is_quarantined(p)
+
+
+def test_transient_failure_retried_until_attempts(tmp_path):
+
+    p = _song(tmp_path)
+    quarantine = Quarantine(tmp_path)
+    for _ in range(MAX_TRANSIENT_ATTEMPTS - 1):
+        quarantine.add(p, "ExtractionTimeout: exceeded 60s", transient=True)
+        assert not quarantine.is_quarantined(p)
+
+    quarantine.add(p, "ExtractionTimeout: exceeded 60s", transient=True)
+    assert quarantine.is_quarantined(p)
+    assert Quarantine(tmp_path).entries[p.name]['attempts'] == MAX_TRANSIENT_ATTEMPTS
+
+
+def test_transient_failure_expires(tmp_path):
+
+    p = _song(tmp_path)
+    quarantine = Quarantine(tmp_path)
+    for _ in range(MAX_TRANSIENT_ATTEMPTS):
+        quarantine.add(p, "Worker process crashed", transient=True)
+
+    last = datetime.now() - TRANSIENT_EXPIRY - timedelta(minutes=1)
+    quarantine.entries[p.name]['last'] = last.strftime("%Y-%m-%d %H:%M:%S")
+    assert not quarantine.is_quarantined(p)
+
+
+def test_attempts_reset_when_file_changes(tmp_path):
+
+    p = _song(tmp_path)
+    quarantine = Quarantine(tmp_path)
+    for _ in range(MAX_TRANSIENT_ATTEMPTS):
+        quarantine.add(p, "OSError: [Errno 5] Input/output error", transient=True)
+
+    p.write_bytes(b"replaced")
+    quarantine.add(p, "OSError: [Errno 5] Input/output error", transient=True)
+    assert quarantine.entries[p.name]['attempts'] == 1
+    assert not quarantine.is_quarantined(p)
+
+
+def test_release_and_prune(tmp_path):
+
+    p = _song(tmp_path)
+    quarantine = Quarantine(tmp_path)
+    quarantine.add(p, "error")
+    quarantine.release(p)
+    assert not quarantine.is_quarantined(p)
+
+    quarantine.add(p, "error")
+    quarantine.prune(["other.flac"])
+    assert Quarantine(tmp_path).entries == {}
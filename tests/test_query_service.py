@@ -0,0 +1,52 @@
+""" Query service started before the first report """
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from src.query_service import QueryService, make_server
+
+from .test_aggregates import library, save_report
+
+
+@pytest.fixture
+def serve(tmp_path):
+
+    service = QueryService(tmp_path)
+    server = make_server(service, host="127.0.0.1", port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def get(path):
+        url = f"http://127.0.0.1:{server.server_port}{path}"
+        try:
+            with urllib.request.urlopen(url) as resp:
+                return resp.status, json.loads(resp.read())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read())
+
+    yield service, get
+    server.shutdown()
+    server.server_close()
+
+
+def test_no_report_yet(tmp_path, serve):
+
+    service, get = serve
+    assert service.snapshot is None
+    assert service.refresh() is False
+
+    assert get("/songs/0")[0] == 503
+    assert get("/songs?filename=0.flac")[0] == 503
+    assert get("/search?q=artist")[0] == 503
+    assert get("/diff?since=2026-01-01%2000-00-00") == (200, [])
+
+    # First report lands; picked up by the next refresh (as by the poller)
+    save_report(library(8), tmp_path/"report 2026-01-01 00-00-00.jsonl")
+    assert service.refresh() is True
+    assert service.refresh() is False
+
+    status, body = get("/songs/0")
+    assert status == 200 and body['ID'] == 0
+    assert get("/songs/99")[0] == 404
@@ -0,0 +1,98 @@
+""" Sniffing of MP3s which do not start with an MPEG frame right after a
+single ID3v2 tag; and extraction of MP3s with missing tags.
+"""
+import pytest
+from mutagen.id3 import ID3, POPM, TIT2
+
+from src.tag_extractor import sniff_format, song_tag_extractor
+
+# MPEG1 Layer III, 128 kbps, 44.1 kHz, no padding: 417-byte frames
+FRAME = b"\xFF\xFB\x90\x64" + b"\x00" * 413
+N_FRAMES = 50
+
+
+def _id3_tag(tmp_path, rated: bool = True) -> bytes :
+    """ An ID3v2.4 tag, as written by mutagen """
+
+    fpath = tmp_path/"tag.id3"
+    tags = ID3()
+    tags.add(TIT2(encoding=3, text="Title"))
+    if rated:
+        tags.add(POPM(email="", rating=196, count=0))
+    tags.save(fpath, v2_version=4, padding=lambda info: 0)
+    return fpath.read_bytes()
+
+
+def _with_footer(tag: bytes) -> bytes :
+    """ tag with the v2.4 footer flag set, and the footer appended """
+
+    header = tag[:5] + bytes([tag[5] | 0x10]) + tag[6:10]
+    return header + tag[10:] + b"3DI" + header[3:]
+
+
+@pytest.mark.parametrize("name, make", [
+    ("padded.mp3", lambda tag: tag + b"\x00" * 2048),
+    ("doubled.MP3", lambda tag: tag + tag),
+    ("footer.mp3", _with_footer),
+])
+def test_mp3_after_id3(tmp_path, name, make):
+
+    fpath = tmp_path/name
+    fpath.write_bytes(make(_id3_tag(tmp_path)) + FRAME * N_FRAMES)
+
+    assert sniff_format(fpath) == 'mp3'
+
+    record = song_tag_extractor(fpath)
+    assert record['Title'] == "Title"
+    assert record['Rating'] == 4.0
+    assert record['Time'] == pytest.approx(N_FRAMES * 1152 / 44100, rel=0.05)
+
+
+def test_mp3_beyond_sniff_window_falls_back_to_extension(tmp_path):
+
+    fpath = tmp_path/"padded.mp3"
+    fpath.write_bytes(b"\x00" * 20000 + FRAME * N_FRAMES)
+
+    assert sniff_format(fpath) == 'mp3'
+    assert sniff_format(fpath.rename(tmp_path/"padded.bin")) is None
+
+
+def test_garbage_named_mp3_is_unsupported(tmp_path):
+
+    fpath = tmp_path/"garbage.mp3"
+    fpath.write_bytes(bytes(range(256)) * 64 + b"\x00" * 20000)
+
+    assert sniff_format(fpath) is None
+
+
+@pytest.mark.parametrize("brand, fmt", [
+    (b"M4A ", 'm4a'), (b"mp42", 'm4a'), (b"heic", None), (b"avif", None), (b"qt  ", None),
+])
+def test_mpeg4_brands(tmp_path, brand, fmt):
+
+    fpath = tmp_path/"file.m4a"
+    fpath.write_bytes(b"\x00\x00\x00\x18ftyp" + brand + b"\x00" * 12)
+
+    assert sniff_format(fpath) == fmt
+
+
+def test_mp3_unrated(tmp_path):
+
+    tag = _id3_tag(tmp_path, rated=False)
+    fpath = tmp_path/"unrated.mp3"
+    fpath.write_bytes(tag + FRAME * N_FRAMES)
+
+    record = song_tag_extractor(fpath)
+    assert record['Title'] == "Title"
+    assert record['Rating'] == 0.0
+
+
+def test_mp3_untagged(tmp_path):
+
+    fpath = tmp_path/"untagged.mp3"
+    fpath.write_bytes(FRAME * N_FRAMES)
+
+    record = song_tag_extractor(fpath)
+    assert record['Title'] is None
+    assert record['Rating'] == 0.0
+    assert record['Key'] is None